@@ -8,15 +8,7 @@ script then creates in HDX.
 import logging
 from os.path import dirname, expanduser, join
 
-from hdx.api.configuration import Configuration
-from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
 from hdx.facades.infer_arguments import facade
-from hdx.location.country import Country
-from hdx.utilities.downloader import Download
-from hdx.utilities.path import temp_dir
-from hdx.utilities.retriever import Retrieve
-
-from hdx.scraper.pcodes.pcodes import Pcodes
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +21,25 @@ def main(
     save: bool = True,
     use_saved: bool = False,
     err_to_hdx: bool = False,
+    legacy_rows: bool = False,
+    workers: int = 1,
+    cache_dir: str = "",
+    clear_cache: bool = False,
+    state_file: str = "",
+    prefetch: bool = True,
+    integrity_report: str = "",
+    run_report: str = "",
+    trace_memory: bool = False,
+    profile_iso: str = "",
+    excel_engine: str = "",
+    pcode_index: str = "",
+    download_workers: int = 0,
+    countries: str = "",
+    country_cache: str = "",
+    memory_limit: int = 0,
+    parse_workers: int = 0,
+    record: str = "",
+    replay: str = "",
 ):
     """Generate dataset and create it in HDX
 
@@ -36,10 +47,58 @@ def main(
         save (bool): Save downloaded data. Defaults to True.
         use_saved (bool): Use saved data. Defaults to False.
         err_to_hdx (bool): Whether to write any errors to HDX metadata. Defaults to False.
+        legacy_rows (bool): Extract gazetteer rows one at a time. Defaults to False.
+        workers (int): Number of countries to process concurrently. Defaults to 1.
+        cache_dir (str): Folder for gazetteer cache. Defaults to "" (no cache).
+        clear_cache (bool): Empty gazetteer cache before running. Defaults to False.
+        state_file (str): State file for incremental runs. Defaults to "" (full run).
+        prefetch (bool): Read all COD-AB datasets in bulk searches. Defaults to True.
+        integrity_report (str): Path for hierarchy integrity report. Defaults to "" (none).
+        run_report (str): Path for timing report (.json or .csv). Defaults to "" (none).
+        trace_memory (bool): Measure memory of stages with tracemalloc. Defaults to False.
+        profile_iso (str): Country to profile into profile-ISO.prof. Defaults to "" (none).
+        excel_engine (str): auto, calamine or default. Defaults to "" (from configuration).
+        pcode_index (str): Path for SQLite p-code index. Defaults to "" (none).
+        download_workers (int): Gazetteers to download ahead at once. Defaults to 0 (none).
+        countries (str): Comma separated ISO3 codes to process, not creating dataset in HDX. Defaults to "" (all).
+        country_cache (str): Path for country data kept between runs. Defaults to "" (none).
+        memory_limit (int): MB of p-codes kept in memory, above which finished countries are written to disk. Defaults to 0 (none).
+        parse_workers (int): Processes parsing gazetteers. Defaults to 0 (workers if > 1, else none).
+        record (str): Folder in which to record a snapshot of the run. Defaults to "" (none).
+        replay (str): Folder of snapshot to replay offline, not creating dataset in HDX. Defaults to "" (none).
 
     Returns:
         None
     """
+    # Imported here so that the CLI starts without loading pandas and the
+    # gazetteer readers
+    from hdx.api.configuration import Configuration
+    from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+    from hdx.utilities.downloader import Download
+    from hdx.utilities.path import temp_dir
+    from hdx.utilities.retriever import Retrieve
+
+    from hdx.scraper.pcodes.cache import GazetteerCache
+    from hdx.scraper.pcodes.countries import load_countries
+    from hdx.scraper.pcodes.datasets import DatasetIndex
+    from hdx.scraper.pcodes.parser import GazetteerParser
+    from hdx.scraper.pcodes.pcodes import Pcodes
+    from hdx.scraper.pcodes.prefetch import GazetteerPrefetcher
+    from hdx.scraper.pcodes.report import RunReport
+    from hdx.scraper.pcodes.snapshot import Snapshot
+    from hdx.scraper.pcodes.state import RunState
+
+    if record and replay:
+        raise ValueError("Cannot record and replay a snapshot in the same run")
+    snapshot = None
+    saved_dir = _SAVED_DATA_DIR
+    if record or replay:
+        snapshot = Snapshot(record or replay, replay=bool(replay))
+        saved_dir = snapshot.folder
+        save = bool(record)
+        use_saved = bool(replay)
+        err_to_hdx = err_to_hdx and not replay
+
     logger.info("##### Updating global p-codes #####")
 
     with HDXErrorHandler(write_to_hdx=err_to_hdx) as error_handler:
@@ -49,26 +108,112 @@ def main(
                 retriever = Retrieve(
                     downloader=downloader,
                     fallback_dir=temp_folder,
-                    saved_dir=_SAVED_DATA_DIR,
+                    saved_dir=saved_dir,
                     temp_dir=temp_folder,
                     save=save,
                     use_saved=use_saved,
                 )
+                output_folder = temp_folder
+                if snapshot:
+                    snapshot.read_hdx_lookups()
+                    if replay:
+                        output_folder = snapshot.get_output_folder()
+
+                cache = None
+                if cache_dir:
+                    cache = GazetteerCache(
+                        cache_dir,
+                        configuration["gazetteer_cache_max_size_mb"] * 1024 * 1024,
+                    )
+                    if clear_cache:
+                        cache.clear()
+
+                datasets = None
+                if snapshot:
+                    datasets = snapshot.read_datasets()
+                elif prefetch:
+                    datasets = DatasetIndex.read_from_hdx()
+
+                state = None
+                if state_file:
+                    state = RunState(state_file, configuration)
+                    if datasets:
+                        state.set_modified_times(datasets.get_modified_times())
+                    else:
+                        state.read_modified_times()
+
+                prefetcher = None
+                if download_workers > 0 and datasets:
+                    prefetcher = GazetteerPrefetcher(
+                        retriever, workers=download_workers
+                    )
+
+                parser = None
+                if parse_workers > 0:
+                    parser = GazetteerParser(
+                        parse_workers, configuration["gazetteer_parse_timeout"]
+                    )
 
+                report = RunReport(
+                    trace_memory=trace_memory,
+                    profile_iso=profile_iso or None,
+                    profile_path=f"profile-{profile_iso}.prof",
+                )
                 pcodes = Pcodes(
                     configuration=configuration,
                     retriever=retriever,
-                    temp_folder=temp_folder,
+                    temp_folder=output_folder,
                     error_handler=error_handler,
+                    legacy_rows=legacy_rows,
+                    cache=cache,
+                    state=state,
+                    datasets=datasets,
+                    report=report,
+                    excel_engine=excel_engine or None,
+                    prefetcher=prefetcher,
+                    memory_limit=memory_limit * 1024 * 1024 if memory_limit else None,
+                    parser=parser,
+                    snapshot=snapshot,
                 )
 
-                countries = [key for key in Country.countriesdata()["countries"]]
-                for country in countries:
-                    pcodes.get_pcodes(country)
-                    pcodes.check_parents(country)
-                    pcodes.get_pcode_lengths(country)
-
-                dataset = pcodes.generate_dataset()
+                if snapshot:
+                    all_countries = snapshot.load_countries(downloader)
+                else:
+                    all_countries = load_countries(
+                        country_cache,
+                        configuration["country_cache_max_age_days"],
+                        downloader,
+                    )
+                if countries:
+                    countries = [iso.strip().upper() for iso in countries.split(",")]
+                else:
+                    countries = all_countries
+                pcodes.process_countries(countries, workers=workers)
+                if prefetcher:
+                    prefetcher.close()
+                    prefetcher.log_stats()
+                if parser:
+                    parser.close()
+                    parser.log_stats()
+                pcodes.name_normalizer.log_stats()
+                if cache:
+                    cache.log_stats()
+                if state:
+                    state.save()
+                    state.log_stats()
+                if integrity_report:
+                    pcodes.write_integrity_report(integrity_report)
+
+                previous_path = None
+                if countries == all_countries:
+                    previous_path = pcodes.download_published_pcodes()
+                dataset = pcodes.generate_dataset(previous_path)
+                if pcode_index:
+                    pcodes.write_pcode_index(pcode_index)
+                pcodes.remove_spilled_pcodes()
+                report.log_summary()
+                if run_report:
+                    report.write(run_report)
                 dataset.update_from_yaml(
                     path=join(
                         dirname(__file__),
@@ -76,11 +221,20 @@ def main(
                         "hdx_dataset_static.yaml",
                     )
                 )
-                dataset.create_in_hdx(
-                    remove_additional_resources=True,
-                    match_resource_order=False,
-                    updated_by_script=_UPDATED_BY_SCRIPT,
-                )
+                if replay:
+                    dataset.save_to_json(join(output_folder, "dataset.json"))
+                    logger.info(
+                        f"Not creating dataset in HDX when replaying, outputs are in "
+                        f"{output_folder}"
+                    )
+                elif countries != all_countries:
+                    logger.info("Not creating dataset in HDX for some countries only")
+                else:
+                    dataset.create_in_hdx(
+                        remove_additional_resources=True,
+                        match_resource_order=False,
+                        updated_by_script=_UPDATED_BY_SCRIPT,
+                    )
 
             logger.info("Finished processing")
 
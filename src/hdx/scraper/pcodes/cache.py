@@ -0,0 +1,130 @@
+import gzip
+import json
+import logging
+from glob import glob
+from hashlib import sha256
+from os import makedirs, remove, replace, utime
+from os.path import basename, exists, getmtime, getsize, join
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+
+logger = logging.getLogger(__name__)
+
+# Increase when a change to the code alters the rows extracted from gazetteers
+# or the format of cache entries
+CACHE_VERSION = 1
+
+
+def rows_to_columns(rows: List[Dict]) -> Dict[str, List]:
+    if not rows:
+        return {}
+    return {header: [row[header] for row in rows] for header in rows[0]}
+
+
+def columns_to_rows(columns: Dict[str, List]) -> List[Dict]:
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+class GazetteerCache:
+    """On disk cache of the p-code rows extracted from gazetteers together with
+    the error handler calls made while extracting them. Entries are keyed on the
+    candidate gazetteer resources, the dataset reference date and the
+    configuration used in extraction, and are stored as gzipped JSON columns. The least recently used
+    entries are evicted when the cache exceeds max_size bytes.
+
+    Args:
+        folder (str): Folder in which to store cache entries
+        max_size (int): Maximum total size of cache entries in bytes
+    """
+
+    def __init__(self, folder: str, max_size: int):
+        self._folder = folder
+        self._max_size = max_size
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        makedirs(folder, exist_ok=True)
+
+    def get_key(
+        self,
+        iso: str,
+        resources: List[Resource],
+        dataset: Dataset,
+        configuration: Dict,
+    ) -> str:
+        """Get the key of the p-codes read from the first of a list of gazetteers
+        that can be opened"""
+        key = json.dumps(
+            [
+                CACHE_VERSION,
+                iso,
+                [(r["id"], r.get("last_modified"), r.get("hash")) for r in resources],
+                dataset.get("dataset_date"),
+                configuration,
+            ],
+            sort_keys=True,
+        )
+        return f"{iso}-{sha256(key.encode('utf-8')).hexdigest()[:32]}"
+
+    def _get_path(self, key: str) -> str:
+        return join(self._folder, f"{key}.json.gz")
+
+    def contains(self, key: str) -> bool:
+        return exists(self._get_path(key))
+
+    def get(self, key: str) -> Optional[Tuple[List[Dict], List]]:
+        """Get rows and error handler calls for key or None if not in cache"""
+        path = self._get_path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            utime(path)
+        except FileNotFoundError:
+            entry = None
+        except (OSError, ValueError):
+            logger.warning(f"Removing unreadable cache entry {basename(path)}")
+            remove(path)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return columns_to_rows(entry["columns"]), entry["calls"]
+
+    def put(self, key: str, rows: List[Dict], calls: List) -> None:
+        path = self._get_path(key)
+        temp_path = f"{path}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump(
+                {"columns": rows_to_columns(rows), "calls": calls}, f, default=str
+            )
+        replace(temp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            paths = sorted(glob(self._get_path("*")), key=getmtime)
+            total_size = sum(getsize(path) for path in paths)
+            for path in paths:
+                if total_size <= self._max_size:
+                    break
+                total_size -= getsize(path)
+                remove(path)
+                self.evictions += 1
+
+    def clear(self, iso: Optional[str] = None) -> None:
+        """Remove the entries for a country or all entries if iso is None"""
+        pattern = f"{iso}-*" if iso else "*"
+        for path in glob(self._get_path(pattern)):
+            remove(path)
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Gazetteer cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions"
+        )
@@ -0,0 +1,107 @@
+import logging
+from collections import Counter
+from csv import reader
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ADDED = "added"
+REMOVED = "removed"
+RENAMED = "renamed"
+REPARENTED = "reparented"
+
+_CHANGE_ORDER = {REMOVED: 0, ADDED: 1, RENAMED: 2, REPARENTED: 3}
+
+_FIELDS = ("Location", "Admin Level", "P-Code", "Name", "Parent P-Code")
+
+
+def _get_key(location: str, level, code: str) -> Tuple[str, str, str]:
+    return location, str(level), code
+
+
+def _get_value(name: Optional[str], parent: Optional[str]) -> Tuple[str, str]:
+    return name or "", parent or ""
+
+
+def _read_rows(path: str) -> Iterator[List[str]]:
+    """Read the fields of a global p-code CSV needed to compare rows as lists,
+    which is faster than DictReader"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = reader(f)
+        headers = next(rows)
+        indices = [headers.index(field) for field in _FIELDS]
+        for row in rows:
+            yield [row[index] for index in indices]
+
+
+def _get_change(change: str, row: Dict, previous: Dict) -> Dict:
+    return {
+        "Location": row["Location"],
+        "Change": change,
+        "Admin Level": row["Admin Level"],
+        "P-Code": row["P-Code"],
+        "Name": row["Name"],
+        "Previous Name": previous.get("Name"),
+        "Parent P-Code": row["Parent P-Code"],
+        "Previous Parent P-Code": previous.get("Parent P-Code"),
+    }
+
+
+def get_changes(previous_path: str, rows: Iterable[Dict]) -> List[Dict]:
+    """Compare p-code rows with a previously published global p-code CSV, keyed
+    on location, admin level and p-code. Only the names and parents of the
+    previous rows are kept in memory: the file is read again for the other
+    values of p-codes that were removed or whose name or parent changed. Returns
+    the changes sorted by location, admin level and p-code, with removed p-codes
+    given by their previous values."""
+    previous = {}
+    for location, level, code, name, parent in _read_rows(previous_path):
+        previous[_get_key(location, level, code)] = _get_value(name, parent)
+
+    changes = []
+    changed = {}
+    for row in rows:
+        key = _get_key(row["Location"], row["Admin Level"], row["P-Code"])
+        value = previous.pop(key, None)
+        if value is None:
+            changes.append(_get_change(ADDED, row, {}))
+        elif value != _get_value(row["Name"], row["Parent P-Code"]):
+            changed[key] = row
+
+    if previous or changed:
+        for values in _read_rows(previous_path):
+            key = _get_key(values[0], values[1], values[2])
+            if key in previous:
+                changes.append(_get_change(REMOVED, dict(zip(_FIELDS, values)), {}))
+                continue
+            row = changed.get(key)
+            if row is None:
+                continue
+            old_row = dict(zip(_FIELDS, values))
+            if (row["Name"] or "") != old_row["Name"]:
+                changes.append(_get_change(RENAMED, row, old_row))
+            if (row["Parent P-Code"] or "") != old_row["Parent P-Code"]:
+                changes.append(_get_change(REPARENTED, row, old_row))
+
+    changes.sort(
+        key=lambda change: (
+            change["Location"],
+            change["Admin Level"],
+            change["P-Code"],
+            _CHANGE_ORDER[change["Change"]],
+        )
+    )
+    return changes
+
+
+def log_changes(changes: List[Dict]) -> None:
+    counts = Counter((change["Location"], change["Change"]) for change in changes)
+    locations = sorted({location for location, _ in counts})
+    logger.info(f"{len(changes)} p-code changes in {len(locations)} locations")
+    for location in locations:
+        summary = ", ".join(
+            f"{counts[(location, change)]} {change}"
+            for change in _CHANGE_ORDER
+            if counts[(location, change)]
+        )
+        logger.info(f"{location}: {summary}")
@@ -0,0 +1,80 @@
+import gzip
+import json
+import logging
+from os import makedirs, replace
+from os.path import abspath, dirname, exists, getmtime
+from time import time
+from typing import Any, Iterator, List, Tuple
+
+from hdx.location.country import Country
+from hdx.utilities.base_downloader import BaseDownload
+
+logger = logging.getLogger(__name__)
+
+
+class _RecordingDownload:
+    """Passes calls to a downloader, keeping the rows of the last table it reads
+    and counting the tables it is asked to read"""
+
+    def __init__(self, downloader: BaseDownload):
+        self._downloader = downloader
+        self.calls = 0
+        self.rows = []
+
+    def get_tabular_rows(self, *args, **kwargs) -> Tuple[List[str], Iterator]:
+        self.calls += 1
+        headers, iterator = self._downloader.get_tabular_rows(*args, **kwargs)
+        self.rows = list(iterator)
+        return headers, iter(self.rows)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._downloader, name)
+
+
+def _read_saved_countries(path: str, max_age_days: float) -> List[dict]:
+    if not path or not exists(path):
+        return []
+    if time() - getmtime(path) > max_age_days * 86400:
+        logger.info(f"Country data in {path} is more than {max_age_days} days old")
+        return []
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.exception(f"Could not read country data in {path}")
+        return []
+
+
+def load_countries(
+    path: str, max_age_days: float, downloader: BaseDownload
+) -> List[str]:
+    """Load Country data, using rows saved at path by an earlier run if they are
+    less than max_age_days old. Otherwise Country reads the rows from the OCHA
+    countries feed, falling back to its static file, and they are saved at path.
+    Rows from the static fallback are not saved, so the feed is tried again next
+    run. If path is empty, nothing is saved.
+
+    Args:
+        path (str): Path of saved country data or "" for none
+        max_age_days (float): Maximum age in days of saved country data
+        downloader (BaseDownload): Downloader with which to read country data
+
+    Returns:
+        List[str]: ISO3 codes of countries
+    """
+    rows = _read_saved_countries(path, max_age_days)
+    if rows:
+        Country.set_countriesdata(rows)
+        logger.info(f"Using country data saved in {path}")
+    else:
+        recorder = _RecordingDownload(downloader)
+        Country.countriesdata(downloader=recorder)
+        # A second call means the feed failed and the static file was read
+        if path and recorder.calls == 1 and recorder.rows:
+            makedirs(dirname(abspath(path)), exist_ok=True)
+            temp_path = f"{path}.tmp"
+            with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+                json.dump(recorder.rows, f)
+            replace(temp_path, path)
+            logger.info(f"Saved country data to {path}")
+    return list(Country.countriesdata()["countries"])
@@ -0,0 +1,57 @@
+import logging
+from glob import glob
+from os.path import join
+from typing import Dict, List, Optional
+
+from hdx.data.dataset import Dataset
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetIndex:
+    """Index of COD-AB datasets by ISO3 code, read from HDX with a few paged
+    searches rather than one request per country. Only datasets that have a COD
+    level and are not archived are indexed.
+
+    Args:
+        datasets (List[Dataset]): COD-AB datasets
+    """
+
+    def __init__(self, datasets: List[Dataset]):
+        self._datasets = {}
+        self._modified_times = {}
+        for dataset in datasets:
+            name = dataset["name"]
+            if not name.startswith("cod-ab-"):
+                continue
+            iso = name[7:].upper()
+            self._modified_times[iso] = dataset.get("metadata_modified")
+            if not dataset.get("cod_level") or dataset.get("archived"):
+                continue
+            self._datasets[iso] = dataset
+        logger.info(f"Indexed {len(self._datasets)} COD-AB datasets")
+
+    @classmethod
+    def read_from_hdx(
+        cls, page_size: int = 1000, folder: Optional[str] = None
+    ) -> "DatasetIndex":
+        """Index the datasets read from HDX, also saving them in folder if given
+        so that they can be loaded with load_from_json"""
+        datasets = Dataset.search_in_hdx(fq="name:cod-ab-*", page_size=page_size)
+        if folder:
+            for dataset in datasets:
+                dataset.save_to_json(join(folder, f"dataset-{dataset['name']}.json"))
+        return cls(datasets)
+
+    @classmethod
+    def load_from_json(cls, folder: str) -> "DatasetIndex":
+        """Index the datasets saved as dataset-cod-ab-*.json files in folder"""
+        paths = sorted(glob(join(folder, "dataset-cod-ab-*.json")))
+        return cls([Dataset.load_from_json(path) for path in paths])
+
+    def get(self, iso: str) -> Optional[Dataset]:
+        return self._datasets.get(iso)
+
+    def get_modified_times(self) -> Dict[str, str]:
+        """Modified times of all COD-AB datasets including those not indexed"""
+        return self._modified_times
@@ -0,0 +1,205 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Pattern, Set, Tuple
+
+_OVERRIDE_COLUMNS = ("code", "name", "parent", "date")
+
+_ALT = re.compile("alt", re.IGNORECASE)
+_PCODE = re.compile(".*pcode?", re.IGNORECASE)
+
+# Patterns matching any column that could be picked for some admin level
+_HEADER_PATTERNS = (
+    re.compile(r".*\d.*code?", re.IGNORECASE),
+    _PCODE,
+    re.compile(r"adm(in)?\d(name)?_?([a-z]{2}$|name$)", re.IGNORECASE),
+    re.compile(r"name_?\d", re.IGNORECASE),
+)
+
+
+class HeaderMapping(NamedTuple):
+    """Columns picked for an admin level of a gazetteer and the messages (text and
+    message type) raised while picking them. The level cannot be read if code or
+    name is None."""
+
+    code: Optional[str]
+    name: Optional[str]
+    parent: Optional[str]
+    dates: Tuple[str, ...]
+    clean_names: bool
+    messages: Tuple[Tuple[str, str], ...]
+
+
+def get_overrides(header_overrides: Dict, iso: str, level: str) -> Dict[str, Any]:
+    """Get the header overrides configured for a country and admin level. Those
+    under "*" apply to all levels. "{level}" in column names is replaced by the
+    admin level."""
+    country = header_overrides.get(iso) or {}
+    overrides = dict(country.get("*") or {})
+    overrides.update(country.get(level) or country.get(int(level)) or {})
+    for key in _OVERRIDE_COLUMNS:
+        if key in overrides:
+            overrides[key] = overrides[key].format(level=level)
+    return overrides
+
+
+def get_override_columns(header_overrides: Dict, iso: str) -> Set[str]:
+    """Get all column names configured as overrides for a country"""
+    return {
+        overrides[key]
+        for level in "1234567"
+        for overrides in (get_overrides(header_overrides, iso, level),)
+        for key in _OVERRIDE_COLUMNS
+        if key in overrides
+    }
+
+
+def is_header_column(header, extra_columns: Iterable[str] = ()) -> bool:
+    """Whether a column could be picked by resolve_headers"""
+    header = str(header)
+    if header.lower() == "validon" or header in extra_columns:
+        return True
+    return any(
+        pattern.match(header) or pattern.match(header.strip())
+        for pattern in _HEADER_PATTERNS
+    )
+
+
+@lru_cache(maxsize=None)
+def _get_patterns(level: str, parentlevel: int) -> Tuple[Pattern, ...]:
+    return (
+        re.compile(f".*{level}.*code?", re.IGNORECASE),
+        re.compile(f"adm(in)?{level}(name)?_?([a-z]{{2}}$|name$)", re.IGNORECASE),
+        re.compile(f"name_?{level}", re.IGNORECASE),
+        re.compile(f".*{parentlevel}.*code?", re.IGNORECASE),
+    )
+
+
+@lru_cache(maxsize=1024)
+def resolve_headers(
+    columns: Tuple,
+    level: str,
+    non_latin_alphabets: Tuple[str, ...],
+    overrides: Tuple[Tuple[str, Any], ...] = (),
+) -> HeaderMapping:
+    """Pick the code, name, parent and date columns for an admin level. Columns are
+    classified in one pass using patterns compiled once per level. Results are
+    cached by header signature since many gazetteers share the same template.
+
+    Args:
+        columns (Tuple): Columns of admin sheet
+        level (str): Admin level
+        non_latin_alphabets (Tuple[str, ...]): Language codes of non latin alphabets
+        overrides (Tuple[Tuple[str, Any], ...]): Items of overrides from get_overrides
+
+    Returns:
+        HeaderMapping: Columns picked and messages
+    """
+    overrides = dict(overrides)
+    parentlevel = overrides.get("parent_level", int(level) - 1)
+    code_pattern, adm_name_pattern, name_pattern, parent_pattern = _get_patterns(
+        level, parentlevel
+    )
+    codeheaders = []
+    nameheaders = []
+    parentheaders = []
+    dateheaders = []
+    pcodeheaders = []
+    for h in columns:
+        header = str(h)
+        lower = header.lower()
+        unhcr = "unhcr" in lower
+        if code_pattern.match(header) and not unhcr:
+            codeheaders.append(h)
+        if (
+            adm_name_pattern.match(header.strip()) or name_pattern.match(header)
+        ) and not _ALT.search(header):
+            nameheaders.append(h)
+        if int(level) > 1 and parent_pattern.match(header) and not unhcr:
+            parentheaders.append(h)
+        if lower == "validon":
+            dateheaders.append(h)
+        if _PCODE.match(header):
+            pcodeheaders.append(h)
+    if "code" in overrides:
+        codeheaders = [overrides["code"]]
+    if "name" in overrides:
+        nameheaders = [overrides["name"]]
+    if "parent" in overrides and int(level) > 1:
+        parentheaders = [overrides["parent"]]
+    if "date" in overrides:
+        dateheaders = [overrides["date"]]
+    clean_names = overrides.get("clean_names", True)
+    messages = []
+
+    def unreadable() -> HeaderMapping:
+        return HeaderMapping(None, None, None, (), clean_names, tuple(messages))
+
+    if len(codeheaders) == 0:
+        codeheaders = pcodeheaders
+        if len(codeheaders) != 1:
+            messages.append((f"Can't find code header at adm{level}", "error"))
+            return unreadable()
+
+    if len(codeheaders) > 1:
+        pcodeheaders = [c for c in codeheaders if "pcode" in str(c).lower()]
+        if len(pcodeheaders) >= 1:
+            codeheaders = [pcodeheaders[0]]
+        else:
+            messages.append(
+                (f"Found multiple code columns at adm{level}, using first", "warning")
+            )
+            codeheaders = [codeheaders[0]]
+
+    if len(nameheaders) == 0:
+        messages.append((f"Can't find name header at adm{level}", "error"))
+        return unreadable()
+
+    if len(nameheaders) > 1:
+        ennameheaders = [n for n in nameheaders if n[-3:].lower() == "_en"]
+        if len(ennameheaders) == 1:
+            nameheaders = ennameheaders
+        else:
+            latin_nameheaders = [
+                n
+                for n in nameheaders
+                if n[-3:-2] == "_" and n[-2:].lower() not in non_latin_alphabets
+            ]
+            if len(latin_nameheaders) > 0:
+                nameheaders = [latin_nameheaders[0]]
+            else:
+                messages.append(
+                    (
+                        f"Found only non-latin alphabet name columns at adm{level}",
+                        "warning",
+                    )
+                )
+                nameheaders = [nameheaders[0]]
+
+    if len(parentheaders) == 0 and int(level) > 1:
+        messages.append((f"Can't find parent code header at adm{level}", "error"))
+
+    if len(parentheaders) > 1 and int(level) > 1:
+        messages.append(
+            (
+                f"Found multiple parent code columns at adm{level}, using first",
+                "warning",
+            )
+        )
+        parentheaders = [parentheaders[0]]
+
+    if len(dateheaders) == 0:
+        messages.append(
+            (
+                f"Can't find date header at adm{level}, using dataset reference date",
+                "warning",
+            )
+        )
+
+    return HeaderMapping(
+        codeheaders[0],
+        nameheaders[0],
+        parentheaders[0] if parentheaders else None,
+        tuple(dateheaders),
+        clean_names,
+        tuple(messages),
+    )
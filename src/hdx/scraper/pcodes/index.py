@@ -0,0 +1,171 @@
+import logging
+import sqlite3
+from os import remove, replace
+from os.path import exists
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from hdx.scraper.pcodes.store import FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Increase when the schema of the index changes
+INDEX_VERSION = 1
+
+_COLUMNS = ("location", "admin_level", "pcode", "name", "parent", "valid_from")
+
+_SELECT = f"SELECT {', '.join(_COLUMNS)} FROM pcodes"
+
+_LEVEL = "CAST(admin_level AS INTEGER)"
+
+# Parents are followed at most this many times when finding ancestors
+_MAX_DEPTH = 10
+
+
+def write_index(path: str, rows: Iterable[Dict], batch_size: int = 10000) -> int:
+    """Write p-code rows to a SQLite index with lookups by p-code, parent and
+    name. The index is written to a temporary file that then replaces any index
+    at path. Returns the number of rows written."""
+    temp_path = f"{path}.tmp"
+    if exists(temp_path):
+        remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    no_rows = 0
+    try:
+        connection.execute(f"CREATE TABLE pcodes ({', '.join(_COLUMNS)})")
+        connection.execute("CREATE TABLE metadata (key PRIMARY KEY, value)")
+        connection.execute(
+            "INSERT INTO metadata VALUES ('version', ?)", (str(INDEX_VERSION),)
+        )
+        insert = f"INSERT INTO pcodes VALUES ({', '.join('?' * len(_COLUMNS))})"
+        batch = []
+        for row in rows:
+            batch.append(tuple(row[field] for field in FIELDS))
+            if len(batch) == batch_size:
+                connection.executemany(insert, batch)
+                no_rows += len(batch)
+                batch = []
+        connection.executemany(insert, batch)
+        no_rows += len(batch)
+        connection.execute("CREATE INDEX pcodes_pcode ON pcodes (pcode)")
+        connection.execute("CREATE INDEX pcodes_parent ON pcodes (parent)")
+        connection.execute("CREATE INDEX pcodes_name ON pcodes (name COLLATE NOCASE)")
+        connection.commit()
+    finally:
+        connection.close()
+    replace(temp_path, path)
+    logger.info(f"Wrote {no_rows} p-codes to index {path}")
+    return no_rows
+
+
+class PcodeIndex:
+    """Read only queries on a SQLite index written by write_index. Rows are
+    returned as dicts with the same keys as the global p-code CSV.
+
+    Args:
+        path (str): Path of index
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        (version,) = self._connection.execute(
+            "SELECT value FROM metadata WHERE key = 'version'"
+        ).fetchone()
+        if int(version) != INDEX_VERSION:
+            self.close()
+            raise ValueError(f"Index {path} has version {version}")
+
+    def __enter__(self) -> "PcodeIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _query(self, sql: str, parameters: tuple) -> List[Dict]:
+        return [
+            dict(zip(FIELDS, values))
+            for values in self._connection.execute(sql, parameters)
+        ]
+
+    @staticmethod
+    def _get_pcode_filter(
+        pcode: str, admin_level: Optional[str]
+    ) -> Tuple[str, Tuple[str, ...]]:
+        """Get the condition and parameters selecting a p-code, optionally at an
+        admin level, ordered so that the first row is the one to use when a
+        p-code is in more than one location or at more than one admin level"""
+        if admin_level:
+            sql = "WHERE pcode = ? AND admin_level = ?"
+            parameters = (pcode, str(admin_level))
+        else:
+            sql = "WHERE pcode = ?"
+            parameters = (pcode,)
+        return f"{sql} ORDER BY location, {_LEVEL}", parameters
+
+    def get(self, pcode: str, admin_level: Optional[str] = None) -> Optional[Dict]:
+        """Get a p-code, optionally at an admin level. A p-code at more than one
+        admin level is that at the highest level (admin 1 before admin 2)."""
+        sql, parameters = self._get_pcode_filter(pcode, admin_level)
+        rows = self._query(f"{_SELECT} {sql} LIMIT 1", parameters)
+        return rows[0] if rows else None
+
+    def get_name(self, pcode: str) -> Optional[str]:
+        row = self.get(pcode)
+        return row["Name"] if row else None
+
+    def get_children(self, pcode: str) -> List[Dict]:
+        return self._query(f"{_SELECT} WHERE parent = ? ORDER BY pcode", (pcode,))
+
+    def get_ancestors(
+        self, pcode: str, admin_level: Optional[str] = None
+    ) -> List[Dict]:
+        """Get the parent of a p-code, optionally at an admin level, its parent
+        and so on up to admin level 1. A parent is in the same location at a
+        lower admin level, the closest if its p-code is at more than one (it is
+        usually one level up, but header overrides can set another)."""
+        sql, parameters = self._get_pcode_filter(pcode, admin_level)
+        return self._query(
+            f"""
+            WITH RECURSIVE ancestors (id, depth) AS (
+                SELECT (SELECT rowid FROM pcodes {sql} LIMIT 1), 0
+                UNION ALL
+                SELECT (
+                    SELECT parent.rowid FROM pcodes AS parent
+                    WHERE parent.pcode = child.parent
+                    AND parent.location = child.location
+                    AND CAST(parent.admin_level AS INTEGER)
+                        < CAST(child.admin_level AS INTEGER)
+                    ORDER BY CAST(parent.admin_level AS INTEGER) DESC LIMIT 1
+                ), depth + 1
+                FROM ancestors JOIN pcodes AS child ON child.rowid = ancestors.id
+                WHERE depth < {_MAX_DEPTH}
+            )
+            SELECT {", ".join(f"pcodes.{column}" for column in _COLUMNS)}
+            FROM ancestors JOIN pcodes ON pcodes.rowid = ancestors.id
+            WHERE depth > 0
+            ORDER BY depth
+            """,
+            parameters,
+        )
+
+    def find_by_name(
+        self,
+        name: str,
+        location: Optional[str] = None,
+        admin_level: Optional[str] = None,
+    ) -> List[Dict]:
+        """Find p-codes with a name, ignoring the case of ASCII letters, optionally
+        in a location and at an admin level"""
+        sql = f"{_SELECT} WHERE name = ? COLLATE NOCASE"
+        parameters = [name]
+        if location:
+            sql = f"{sql} AND location = ?"
+            parameters.append(location)
+        if admin_level:
+            sql = f"{sql} AND admin_level = ?"
+            parameters.append(str(admin_level))
+        return self._query(f"{sql} ORDER BY location, pcode", tuple(parameters))
@@ -0,0 +1,77 @@
+import logging
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+from typing import Iterable, List
+from unicodedata import normalize
+
+from pandas import Series
+
+logger = logging.getLogger(__name__)
+
+
+def clean_name(name: str) -> str:
+    """Convert a name to ASCII, strip it and title case it if it is all lower or
+    all upper case. Names that are already ASCII skip NFKD normalisation, which
+    cannot change them."""
+    if not name.isascii():
+        name = normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    name = name.strip()
+    if name.islower() or name.isupper():
+        name = name.title()
+    return name
+
+
+class NameNormalizer:
+    """Cleans admin names with clean_name, keeping results in a bounded LRU cache
+    since names repeat across admin levels and countries. Counts cache hits and
+    misses and the time spent cleaning.
+
+    Args:
+        max_size (int): Maximum number of names to cache. Defaults to 100000.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self._clean_name = lru_cache(maxsize=max_size)(clean_name)
+        self._lock = Lock()
+        self.time = 0.0
+
+    @property
+    def hits(self) -> int:
+        return self._clean_name.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        return self._clean_name.cache_info().misses
+
+    def _add_time(self, start: float) -> None:
+        with self._lock:
+            self.time += perf_counter() - start
+
+    def normalize(self, name) -> str:
+        start = perf_counter()
+        name = self._clean_name(name if isinstance(name, str) else str(name))
+        self._add_time(start)
+        return name
+
+    def normalize_names(self, names: Iterable) -> List:
+        """Clean a column of names such as a pandas Series. Empty names are
+        returned unchanged and missing values in a Series as None."""
+        start = perf_counter()
+        if isinstance(names, Series):
+            names = names.astype(object).where(names.notna(), None)
+        clean = self._clean_name
+        names = [
+            (clean(name if isinstance(name, str) else str(name)) if name else name)
+            for name in names
+        ]
+        self._add_time(start)
+        return names
+
+    def log_stats(self) -> None:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        logger.info(
+            f"Name normalizer: {lookups} names, {hit_rate:.1%} cache hits, "
+            f"{self.time:.2f}s"
+        )
@@ -0,0 +1,95 @@
+import gzip
+import logging
+from importlib.util import find_spec
+from shutil import copyfileobj
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# Package needed by each output writer
+WRITER_PACKAGES = {"csv.gz": None, "csv.zst": "zstandard", "parquet": "pyarrow"}
+
+_ROW_GROUP_SIZE = 1000000  # Maximum rows in a Parquet row group
+
+
+def is_writer_available(writer: str) -> bool:
+    if writer not in WRITER_PACKAGES:
+        raise ValueError(f"Unknown output writer {writer}")
+    package = WRITER_PACKAGES[writer]
+    return package is None or find_spec(package) is not None
+
+
+def compress_gzip(source: str, path: str) -> None:
+    with open(source, "rb") as source_file, gzip.open(path, "wb") as f:
+        copyfileobj(source_file, f)
+
+
+def compress_zstd(source: str, path: str, level: int = 19) -> None:
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=level)
+    with open(source, "rb") as source_file, open(path, "wb") as f:
+        compressor.copy_stream(source_file, f)
+
+
+def _get_parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("Location", pa.dictionary(pa.int16(), pa.string())),
+            ("Admin Level", pa.int8()),
+            ("P-Code", pa.string()),
+            ("Name", pa.string()),
+            ("Parent P-Code", pa.string()),
+            ("Valid from date", pa.date32()),
+        ]
+    )
+
+
+def _get_parquet_table(schema, rows: List[Dict]):
+    """Convert rows of one country to a table with the types of schema. Dates that
+    are not in YYYY-MM-DD format become nulls."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns = {field: [row[field] for row in rows] for field in schema.names}
+    levels = pa.array([int(level) for level in columns["Admin Level"]], pa.int8())
+    dates = pc.strptime(
+        pa.array(columns["Valid from date"], pa.string()),
+        format="%Y-%m-%d",
+        unit="s",
+        error_is_null=True,
+    )
+    arrays = [
+        pa.array(columns["Location"], pa.string()).dictionary_encode(),
+        levels,
+        pa.array(columns["P-Code"], pa.string()),
+        pa.array(columns["Name"], pa.string()),
+        pa.array(columns["Parent P-Code"], pa.string()),
+        dates.cast(pa.date32()),
+    ]
+    invalid_dates = dates.null_count - pa.array(columns["Valid from date"]).null_count
+    if invalid_dates:
+        logger.warning(f"{invalid_dates} dates in {rows[0]['Location']} are invalid")
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(path: str, countries: Iterable[Iterable[Dict]]) -> int:
+    """Write p-codes to Parquet with typed columns, writing each country as its
+    own row groups so that readers filtering on Location skip other countries.
+    Location is dictionary encoded. Returns the number of rows written."""
+    import pyarrow.parquet as pq
+
+    schema = _get_parquet_schema()
+    no_rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for rows in countries:
+            rows = list(rows)
+            if not rows:
+                continue
+            writer.write_table(
+                _get_parquet_table(schema, rows), row_group_size=_ROW_GROUP_SIZE
+            )
+            no_rows += len(rows)
+    return no_rows
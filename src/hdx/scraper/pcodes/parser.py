@@ -0,0 +1,115 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GazetteerParseError(Exception):
+    """A gazetteer could not be parsed in a GazetteerParser's pool"""
+
+
+def _terminate(pool: ProcessPoolExecutor) -> None:
+    """Shut down a pool without waiting for running tasks by killing its
+    processes"""
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+class GazetteerParser:
+    """Pool of processes shared by all countries in which gazetteers are parsed,
+    so that parsing, which holds the GIL, runs in parallel. At most workers
+    gazetteers are submitted at once, so each starts as soon as it is submitted
+    and the timeout only counts its parsing. If parsing raises, takes longer than
+    timeout seconds or kills its process, for example on a corrupt workbook,
+    GazetteerParseError is raised. The pool is then restarted if needed, and
+    gazetteers that were parsing in a restarted pool are retried once.
+
+    Args:
+        workers (int): Number of processes. Defaults to 2.
+        timeout (Optional[float]): Seconds to wait for each gazetteer. Defaults to None (no limit).
+    """
+
+    def __init__(self, workers: int = 2, timeout: Optional[float] = None):
+        self._workers = workers
+        self._timeout = timeout
+        self._slots = BoundedSemaphore(workers)
+        self._lock = Lock()
+        self._pool = None
+        self.parsed = 0
+        self.failed = 0
+        self.restarts = 0
+
+    def __enter__(self) -> "GazetteerParser":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers, mp_context=get_context("spawn")
+                )
+            return self._pool
+
+    def _restart(self, pool: ProcessPoolExecutor) -> None:
+        """Replace pool unless another thread already has"""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self.restarts += 1
+        _terminate(pool)
+
+    def _fail(self, message: str) -> GazetteerParseError:
+        with self._lock:
+            self.failed += 1
+        return GazetteerParseError(message)
+
+    def parse(self, function: Callable, path: str, *args) -> Any:
+        """Call function with path and args in a process of the pool, returning
+        its result"""
+        with self._slots:
+            for attempt in range(2):
+                pool = self._get_pool()
+                try:
+                    result = pool.submit(function, path, *args).result(
+                        timeout=self._timeout
+                    )
+                except FutureTimeoutError:
+                    self._restart(pool)
+                    raise self._fail(f"timed out after {self._timeout} seconds")
+                except BrokenProcessPool:
+                    self._restart(pool)
+                    if attempt == 0:
+                        logger.info(
+                            f"Process pool broke while parsing {path}, retrying"
+                        )
+                        continue
+                    raise self._fail("process parsing it stopped unexpectedly")
+                except Exception as ex:
+                    raise self._fail(f"{type(ex).__name__}: {ex}") from ex
+                with self._lock:
+                    self.parsed += 1
+                return result
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Parsed {self.parsed} gazetteers in {self._workers} processes, "
+            f"{self.failed} failed, {self.restarts} pool restarts"
+        )
@@ -1,21 +1,246 @@
+import gc
+import json
 import logging
 import re
-from typing import Dict
-from unicodedata import normalize
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from csv import DictWriter
+from functools import lru_cache
+from importlib.util import find_spec
+from itertools import compress
+from math import inf
+from operator import itemgetter
+from os import makedirs, remove
+from os.path import exists, getsize, join, splitext
+from shutil import rmtree
+from threading import Lock, local
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from hdx.api.configuration import Configuration
 from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
 from hdx.data.dataset import Dataset, HDXError
 from hdx.data.resource import Resource
 from hdx.location.country import Country
-from hdx.utilities.dictandlist import dict_of_lists_add, dict_of_sets_add
+from hdx.utilities.base_downloader import DownloadError
+from hdx.utilities.dictandlist import dict_of_lists_add
+from hdx.utilities.downloader import Download
 from hdx.utilities.retriever import Retrieve
-from pandas import Timestamp, isna, read_excel
+from pandas import DataFrame, ExcelFile, Series, Timestamp, isna
 from xlrd import xldate_as_datetime
 
+from hdx.scraper.pcodes.cache import GazetteerCache
+from hdx.scraper.pcodes.changes import get_changes, log_changes
+from hdx.scraper.pcodes.datasets import DatasetIndex
+from hdx.scraper.pcodes.headers import (
+    get_override_columns,
+    get_overrides,
+    is_header_column,
+    resolve_headers,
+)
+from hdx.scraper.pcodes.index import write_index
+from hdx.scraper.pcodes.names import NameNormalizer
+from hdx.scraper.pcodes.outputs import (
+    WRITER_PACKAGES,
+    compress_gzip,
+    compress_zstd,
+    is_writer_available,
+    write_parquet,
+)
+from hdx.scraper.pcodes.parser import GazetteerParseError, GazetteerParser
+from hdx.scraper.pcodes.prefetch import GazetteerPrefetcher
+from hdx.scraper.pcodes.report import RunReport
+from hdx.scraper.pcodes.snapshot import Snapshot
+from hdx.scraper.pcodes.state import RunState
+from hdx.scraper.pcodes.store import CountryPcodes, SpilledCountryPcodes
+
 logger = logging.getLogger(__name__)
 
 
+def _format_date(row_date):
+    if isinstance(row_date, Timestamp):
+        return row_date.strftime("%Y-%m-%d")
+    if isinstance(row_date, int):
+        return xldate_as_datetime(row_date, 0).strftime("%Y-%m-%d")
+    return row_date
+
+
+_INTEGRITY_ISSUES = ("Missing parents", "Wrong level parents", "Cycles")
+
+_MAX_ADMIN_LEVEL = 5  # Highest admin level in p-code lengths
+
+_SPILL_FOLDER = "spill"  # Folder in temp folder of countries written to disk
+
+# Configuration that affects the rows extracted from gazetteers
+_CACHE_CONFIGURATION = ("header_overrides", "non_latin_alphabets")
+
+
+_EXCEL_ENGINES = ("auto", "calamine", "default")
+
+
+def _get_excel_engine(excel_engine: str) -> Optional[str]:
+    """Get the pandas engine for reading gazetteers: calamine if asked for (or
+    auto) and python-calamine is installed, otherwise None for pandas' default
+    engines, openpyxl and xlrd, which read cells the same way"""
+    if excel_engine not in _EXCEL_ENGINES:
+        raise ValueError(f"Unknown Excel engine {excel_engine}")
+    if excel_engine == "default":
+        return None
+    if find_spec("python_calamine"):
+        return "calamine"
+    if excel_engine == "calamine":
+        logger.warning("python-calamine is not installed, using default engines")
+    return None
+
+
+def _read_admin_sheets(
+    filepath: str, extra_columns: Tuple[str, ...] = (), engine: Optional[str] = None
+) -> Dict[str, DataFrame]:
+    """Read only the admin sheets of a gazetteer and only the columns in them
+    that header detection can use"""
+    with ExcelFile(filepath, engine=engine) as excel_file:
+        sheetnames = [
+            s
+            for s in excel_file.sheet_names
+            if bool(re.match(".*adm(in)?.?[1-7].*", s, re.IGNORECASE))
+        ]
+        if len(sheetnames) == 0:
+            return {}
+        return excel_file.parse(
+            sheet_name=sheetnames,
+            usecols=lambda header: is_header_column(header, extra_columns),
+        )
+
+
+def _get_gazetteer_keywords(resource: Resource) -> List[str]:
+    """Get the keywords that suggest a resource is a gazetteer"""
+    keywords = []
+    description = resource["description"].lower()
+    for keyword in ("gazetteer", "taxonomy"):
+        if keyword in description:
+            keywords.append(f"{keyword} in description")
+    if re.match(".*adm.*tabular.?data.*", resource["name"], re.IGNORECASE):
+        keywords.append("tabular data name")
+    return keywords
+
+
+@lru_cache(maxsize=None)
+def _get_country_code_length(start: str) -> int:
+    """Get the length of the country code that starts a p-code from the p-code's
+    first 3 characters: 3 for an ISO3 code, 2 for an ISO2 code, otherwise 0"""
+    if Country.get_country_info_from_iso3(start):
+        return 3
+    if Country.get_country_info_from_iso2(start[:2]):
+        return 2
+    return 0
+
+
+def _join_length_counts(counts: Counter) -> Tuple[Optional[str], Optional[str]]:
+    """Join lengths with | in ascending order, and the lengths with their counts
+    as length:count"""
+    if len(counts) == 0:
+        return None, None
+    lengths = sorted(counts)
+    return (
+        "|".join(str(length) for length in lengths),
+        "|".join(f"{length}:{counts[length]}" for length in lengths),
+    )
+
+
+def _find_cycles(parents: Dict[str, str]) -> List[List[str]]:
+    """Find cycles in a mapping of p-code to parent p-code, visiting each p-code
+    once"""
+    visited = {}
+    cycles = []
+    for start in parents:
+        path = []
+        code = start
+        while code in parents and code not in visited:
+            visited[code] = start
+            path.append(code)
+            code = parents[code]
+        if visited.get(code) == start and code in parents:
+            cycles.append(path[path.index(code) :])
+    return cycles
+
+
+class _AdminLevelIndex:
+    """Codes and rows seen so far in an admin sheet"""
+
+    def __init__(self):
+        self._code_counts = Counter()
+        self._rows = set()
+
+    def add_codes(self, codes: Iterable[str]) -> None:
+        self._code_counts.update(codes)
+
+    def add_row(self, row: Tuple) -> bool:
+        """Returns True if row has not been seen before"""
+        if row in self._rows:
+            return False
+        self._rows.add(row)
+        return True
+
+    def get_duplicates(self) -> Dict[str, int]:
+        return {code: count for code, count in self._code_counts.items() if count > 1}
+
+
+class _SynchronisedErrorHandler:
+    """Serialises calls to an error handler shared between worker threads"""
+
+    def __init__(self, error_handler: HDXErrorHandler):
+        self._error_handler = error_handler
+        self._lock = Lock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._error_handler, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return locked
+
+
+class _RecordingErrorHandler:
+    """Passes calls through to an error handler, recording the calls that add
+    messages made in the current thread while recording is on. Recordings can be
+    nested."""
+
+    def __init__(self, error_handler: HDXErrorHandler):
+        self._error_handler = error_handler
+        self._local = local()
+
+    def _get_recordings(self) -> List[List]:
+        if not hasattr(self._local, "recordings"):
+            self._local.recordings = []
+        return self._local.recordings
+
+    def start_recording(self) -> None:
+        self._get_recordings().append([])
+
+    def stop_recording(self) -> List:
+        return self._get_recordings().pop()
+
+    def replay(self, calls: List) -> None:
+        for name, args, kwargs in calls:
+            getattr(self, name)(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._error_handler, name)
+        if not name.startswith("add_"):
+            return attr
+
+        def record(*args, **kwargs):
+            for calls in self._get_recordings():
+                calls.append((name, args, kwargs))
+            return attr(*args, **kwargs)
+
+        return record
+
+
 class Pcodes:
     def __init__(
         self,
@@ -23,19 +248,204 @@ class Pcodes:
         retriever: Retrieve,
         temp_folder: str,
         error_handler: HDXErrorHandler,
+        legacy_rows: bool = False,
+        cache: Optional[GazetteerCache] = None,
+        state: Optional[RunState] = None,
+        datasets: Optional[DatasetIndex] = None,
+        report: Optional[RunReport] = None,
+        excel_engine: Optional[str] = None,
+        prefetcher: Optional[GazetteerPrefetcher] = None,
+        memory_limit: Optional[int] = None,
+        parser: Optional[GazetteerParser] = None,
+        snapshot: Optional[Snapshot] = None,
     ):
         self._configuration = configuration
         self._retriever = retriever
         self._temp_folder = temp_folder
         self._error_handler = error_handler
+        self._legacy_rows = legacy_rows
+        self._cache = cache
+        self._state = state
+        self._datasets = datasets
+        if cache or state:
+            self._error_handler = _RecordingErrorHandler(error_handler)
+        self._parser = parser
+        self._thread_retrievers = None
+        self._thread_downloaders = []
+        self._thread_downloaders_lock = Lock()
         self.pcodes = {}
         self.pcode_lengths = []
+        self.integrity = {}
+        self.header_mappings = {}
+        self.name_normalizer = NameNormalizer(configuration["name_cache_max_size"])
+        self.report = report or RunReport()
+        self._excel_engine = _get_excel_engine(
+            excel_engine or configuration["excel_engine"]
+        )
+        self._prefetcher = prefetcher
+        self._memory_limit = memory_limit
+        self._kept_lock = Lock()
+        self.kept_size = 0
+        self._snapshot = snapshot
+
+    def process_country(self, iso: str) -> None:
+        with self.report.profile(iso), self.report.stage("total", iso):
+            self.get_pcodes(iso)
+            self.report.set_rows(iso, len(self.pcodes.get(iso, [])))
+            with self.report.stage("check_parents", iso):
+                self.check_parents(iso)
+            with self.report.stage("pcode_lengths", iso):
+                self.get_pcode_lengths(iso)
+            if self._memory_limit is not None:
+                with self.report.stage("spill", iso):
+                    self.spill_pcodes(iso)
+
+    def spill_pcodes(self, iso: str) -> None:
+        """Write a country's p-codes to a file in the spill folder if keeping them
+        in memory would take the p-codes kept in memory above memory_limit bytes,
+        so that they are only read back when the outputs are written. Collecting
+        garbage frees the DataFrames of the gazetteer, which pandas can leave in
+        reference cycles, before the next gazetteer is read."""
+        gc.collect()
+        pcodes = self.pcodes.get(iso)
+        if not isinstance(pcodes, CountryPcodes):
+            return
+        size = pcodes.get_size()
+        with self._kept_lock:
+            if self.kept_size + size <= self._memory_limit:
+                self.kept_size += size
+                return
+        folder = join(self._temp_folder, _SPILL_FOLDER)
+        makedirs(folder, exist_ok=True)
+        self.pcodes[iso] = SpilledCountryPcodes(join(folder, f"{iso}.json"), pcodes)
+
+    def remove_spilled_pcodes(self) -> None:
+        """Delete the spill folder once all outputs are written, dropping the
+        p-codes of the countries spilled to it"""
+        for iso, rows in list(self.pcodes.items()):
+            if isinstance(rows, SpilledCountryPcodes):
+                del self.pcodes[iso]
+        rmtree(join(self._temp_folder, _SPILL_FOLDER), ignore_errors=True)
+
+    def process_countries(self, countries: List[str], workers: int = 1) -> None:
+        """Process countries, concurrently if workers > 1. Downloads run in a pool
+        of threads and gazetteers are parsed in a pool of processes, the parser
+        if given. With a prefetcher, gazetteers are downloaded ahead and, if
+        workers is 1, countries are processed as their downloads finish. Results
+        are put in the same order as when processing countries one by one."""
+        no_lengths = len(self.pcode_lengths)
+        if workers <= 1:
+            for iso in self._get_processing_order(countries):
+                self.process_country(iso)
+        else:
+            self._prefetch_gazetteers(countries)
+            self._process_countries_concurrently(countries, workers)
+        pcodes = {
+            iso: rows for iso, rows in self.pcodes.items() if iso not in countries
+        }
+        for iso in countries:
+            if iso in self.pcodes:
+                pcodes[iso] = self.pcodes[iso]
+        self.pcodes = pcodes
+        order = {iso: i for i, iso in enumerate(countries)}
+        self.pcode_lengths[no_lengths:] = sorted(
+            self.pcode_lengths[no_lengths:], key=lambda k: order[k["Location"]]
+        )
+
+    def _process_countries_concurrently(
+        self, countries: List[str], workers: int
+    ) -> None:
+        error_handler = self._error_handler
+        parser = self._parser
+        self._error_handler = _SynchronisedErrorHandler(error_handler)
+        self._thread_retrievers = local()
+        if parser is None:
+            self._parser = GazetteerParser(
+                workers, self._configuration["gazetteer_parse_timeout"]
+            )
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self.process_country, iso) for iso in countries
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            if parser is None:
+                self._parser.close()
+            self._parser = parser
+            self._thread_retrievers = None
+            self._close_thread_downloaders()
+            self._error_handler = error_handler
+
+    def _prefetch_gazetteers(self, countries: List[str]) -> Dict[str, str]:
+        """Start downloading the best gazetteer of each country that will need
+        one. Only possible with a dataset index. Returns the urls by country."""
+        if not self._prefetcher or not self._datasets:
+            return {}
+        configuration = {key: self._configuration[key] for key in _CACHE_CONFIGURATION}
+        urls = {}
+        for iso in countries:
+            if self._state and self._state.is_unchanged(iso):
+                continue
+            dataset = self._datasets.get(iso)
+            if not dataset or not dataset.get("cod_level") or dataset.get("archived"):
+                continue
+            candidates = self._get_candidates(dataset, iso)
+            if not candidates:
+                continue
+            if self._cache:
+                resources = [resource for resource, _ in candidates]
+                key = self._cache.get_key(iso, resources, dataset, configuration)
+                if self._cache.contains(key):
+                    continue
+            urls[iso] = candidates[0][0]["url"]
+        self._prefetcher.prefetch(list(urls.values()))
+        return urls
+
+    def _get_processing_order(self, countries: List[str]) -> Iterator[str]:
+        """Iterate over countries that need no download, then the others as their
+        gazetteers finish downloading"""
+        urls = self._prefetch_gazetteers(countries)
+        for iso in countries:
+            if iso not in urls:
+                yield iso
+        isos = {}
+        for iso, url in urls.items():
+            dict_of_lists_add(isos, url, iso)
+        for url in self._prefetcher.iterate_completed(list(isos)) if isos else ():
+            yield from isos[url]
+
+    def _read_dataset(self, name: str) -> Optional[Dataset]:
+        if self._snapshot:
+            return self._snapshot.read_dataset(name)
+        return Dataset.read_from_hdx(name)
 
     def get_pcodes(self, iso: str) -> None:
+        if not self._state:
+            self.read_pcodes(iso)
+            return
+        with self.report.stage("state", iso):
+            unchanged = self._state.get_unchanged(iso)
+            if unchanged:
+                self._add_saved_pcodes(iso, *unchanged)
+                return
+        self._error_handler.start_recording()
         try:
-            dataset = Dataset.read_from_hdx(f"cod-ab-{iso.lower()}")
-        except HDXError:
-            dataset = None
+            dataset = self.read_pcodes(iso)
+        finally:
+            calls = self._error_handler.stop_recording()
+        self._state.set_country(iso, dataset, self.pcodes.get(iso, []), calls)
+
+    def read_pcodes(self, iso: str) -> Optional[Dataset]:
+        with self.report.stage("read_dataset", iso):
+            if self._datasets:
+                dataset = self._datasets.get(iso)
+            else:
+                try:
+                    dataset = self._read_dataset(f"cod-ab-{iso.lower()}")
+                except HDXError:
+                    dataset = None
 
         if not dataset or not dataset.get("cod_level") or dataset.get("archived"):
             self._error_handler.add_message(
@@ -44,23 +454,66 @@ class Pcodes:
                 "Could not find dataset",
                 message_type="warning",
             )
-            return
-
-        gazetteer = self.find_gazetteer(dataset, iso)
-        if not gazetteer:
-            return
+            return dataset
 
-        open_gazetteer = self.open_gazetteer(gazetteer, iso)
+        with self.report.stage("find_gazetteer", iso):
+            gazetteers = self.rank_gazetteers(dataset, iso)
+        if not gazetteers:
+            return dataset
 
-        self.get_pcodes_from_gazetteer(open_gazetteer, iso, dataset)
+        if self._cache:
+            self.get_pcodes_from_cache(gazetteers, iso, dataset)
+        else:
+            open_gazetteer = self.open_gazetteers(gazetteers, iso)
+            with self.report.stage("rows", iso):
+                self.get_pcodes_from_gazetteer(open_gazetteer, iso, dataset)
 
         missing_units = self._configuration["missing_units"].get(iso)
         if missing_units:
-            for _, unit in missing_units.items():
-                self.pcodes[iso].append(dict(unit))
-        return
+            self._add_pcodes(iso, missing_units.values())
+        return dataset
+
+    def _add_pcodes(self, iso: str, rows: Iterable[Dict]) -> None:
+        for row in rows:
+            if iso not in self.pcodes:
+                self.pcodes[iso] = CountryPcodes()
+            self.pcodes[iso].append(row)
+
+    def _add_saved_pcodes(self, iso: str, rows: List[Dict], calls: List) -> None:
+        self._error_handler.replay(calls)
+        self._add_pcodes(iso, rows)
+
+    def get_pcodes_from_cache(
+        self, resources: List[Resource], iso: str, dataset: Dataset
+    ) -> None:
+        """Get p-codes from the cache, reading the gazetteer and adding the result
+        to the cache if not found"""
+        configuration = {key: self._configuration[key] for key in _CACHE_CONFIGURATION}
+        with self.report.stage("cache", iso):
+            key = self._cache.get_key(iso, resources, dataset, configuration)
+            entry = self._cache.get(key)
+            if entry:
+                self._add_saved_pcodes(iso, *entry)
+                return
 
-    def find_gazetteer(self, dataset, iso):
+        self._error_handler.start_recording()
+        try:
+            open_gazetteer = self.open_gazetteers(resources, iso)
+            with self.report.stage("rows", iso):
+                self.get_pcodes_from_gazetteer(open_gazetteer, iso, dataset)
+        finally:
+            calls = self._error_handler.stop_recording()
+        with self.report.stage("cache", iso):
+            self._cache.put(key, self.pcodes.get(iso, []), calls)
+
+    def _get_candidates(
+        self, dataset: Dataset, iso: str
+    ) -> List[Tuple[Resource, List[str]]]:
+        """Get the candidate gazetteers of a dataset, best first, with the keywords
+        they match. Equivalent files, those with the same name apart from the
+        extension, are ordered smallest first and kept together. Otherwise
+        gazetteers with more of the expected keywords come first, then the most
+        recently modified."""
         exceptions = self._configuration["resource_exceptions"]
         if iso in exceptions:
             resources = [
@@ -71,63 +524,133 @@ class Pcodes:
                 r for r in dataset.get_resources() if r.get_format() in ["xlsx", "xls"]
             ]
 
-        if len(resources) == 0:
-            self._error_handler.add_message(
-                "PCodes",
-                dataset["name"],
-                "Could not find gazetteer",
-            )
-            return None
+        candidates = [(r, _get_gazetteer_keywords(r)) for r in resources]
+        if len(candidates) > 1:
+            candidates = [(r, keywords) for r, keywords in candidates if keywords]
 
-        if len(resources) > 1:
-            resources = [
-                r
-                for r in resources
-                if "gazetteer" in r["description"].lower()
-                or "taxonomy" in r["description"].lower()
-                or bool(re.match(".*adm.*tabular.?data.*", r["name"], re.IGNORECASE))
-            ]
+        groups = {}
+        for resource, keywords in candidates:
+            stem = splitext(resource["name"])[0].lower()
+            dict_of_lists_add(groups, stem, (resource, keywords))
+        groups = sorted(
+            groups.values(),
+            key=lambda group: (
+                max(len(k) for _, k in group),
+                max(r.get("last_modified") or "" for r, _ in group),
+            ),
+            reverse=True,
+        )
+        ranked = []
+        for group in groups:
+            ranked.extend(
+                sorted(group, key=lambda candidate: candidate[0].get("size") or inf)
+            )
+        return ranked
 
-        if len(resources) == 0:
+    def rank_gazetteers(self, dataset: Dataset, iso: str) -> List[Resource]:
+        """Get the candidate gazetteers of a dataset, best first, explaining the
+        ranking in the log"""
+        ranked = self._get_candidates(dataset, iso)
+        if len(ranked) == 0:
             self._error_handler.add_message(
                 "PCodes",
                 dataset["name"],
                 "Could not find gazetteer",
             )
-            return None
+            return []
 
-        return resources[0]
-
-    def open_gazetteer(self, resource: Resource, iso: str) -> Dict:
-        filepath = self._retriever.download_file(resource["url"])
-        data = read_excel(filepath, sheet_name=None)
-        sheetnames = [
-            s for s in data if bool(re.match(".*adm(in)?.?[1-7].*", s, re.IGNORECASE))
+        explanations = [
+            f"{i}. {r['name']} ({r.get_format()}, {r.get('size') or 'unknown'} bytes, "
+            f"modified {r.get('last_modified') or 'unknown'}"
+            f"{''.join(f', {k}' for k in keywords)})"
+            for i, (r, keywords) in enumerate(ranked, start=1)
         ]
+        logger.info(f"Gazetteers for {iso}: {'; '.join(explanations)}")
+        return [resource for resource, _ in ranked]
 
-        if len(sheetnames) == 0:
-            self._error_handler.add_message(
-                "PCodes",
-                f"cod-ab-{iso.lower()}",
-                f"Could not find admin tabs in {resource['name']}",
+    def _get_retriever(self) -> Retrieve:
+        """Get the Retrieve object of the current thread. A Download keeps the
+        response it is reading, so when countries are processed concurrently each
+        thread gets its own Download sharing the session of the main one."""
+        if self._thread_retrievers is None:
+            return self._retriever
+        retriever = getattr(self._thread_retrievers, "retriever", None)
+        if retriever is None:
+            downloader = Download(session=self._retriever.downloader.session)
+            with self._thread_downloaders_lock:
+                self._thread_downloaders.append(downloader)
+            retriever = self._retriever.clone(downloader)
+            self._thread_retrievers.retriever = retriever
+        return retriever
+
+    def _close_thread_downloaders(self) -> None:
+        """Close the responses of the threads' Download objects. Their shared
+        session belongs to the main Download, which closes it."""
+        with self._thread_downloaders_lock:
+            downloaders = self._thread_downloaders
+            self._thread_downloaders = []
+        for downloader in downloaders:
+            downloader.close_response()
+
+    def _read_gazetteer(self, resource: Resource, iso: str) -> Dict:
+        with self.report.stage("download", iso):
+            if self._prefetcher:
+                filepath = self._prefetcher.get(resource["url"])
+            else:
+                filepath = self._get_retriever().download_file(resource["url"])
+        self.report.add_bytes(iso, getsize(filepath))
+        extra_columns = tuple(
+            sorted(get_override_columns(self._configuration["header_overrides"], iso))
+        )
+        with self.report.stage("read_excel", iso):
+            if self._parser:
+                return self._parser.parse(
+                    _read_admin_sheets, filepath, extra_columns, self._excel_engine
+                )
+            return _read_admin_sheets(filepath, extra_columns, self._excel_engine)
+
+    def open_gazetteers(self, resources: List[Resource], iso: str) -> Dict:
+        """Open the first gazetteer that has admin tabs, trying the next one when
+        a gazetteer has none or cannot be read. Gazetteers that cannot be read,
+        whether in the parser's processes or not, are logged and only reported,
+        rather than raising, if no candidate can be opened."""
+        errors = {}
+        for resource in resources:
+            try:
+                data = self._read_gazetteer(resource, iso)
+            except GazetteerParseError as ex:
+                logger.warning(f"Could not parse {resource['name']}: {ex}")
+                errors[resource["name"]] = f"Could not parse {resource['name']}: {ex}"
+                continue
+            except Exception as ex:
+                logger.exception(f"Could not read {resource['name']}")
+                errors[resource["name"]] = (
+                    f"Could not read {resource['name']}: {type(ex).__name__}: {ex}"
+                )
+                continue
+            if len(data) != 0:
+                return data
+            logger.info(f"No admin tabs in {resource['name']}")
+
+        for resource in resources:
+            message = errors.get(
+                resource["name"], f"Could not find admin tabs in {resource['name']}"
             )
-            return {}
+            self._error_handler.add_message("PCodes", f"cod-ab-{iso.lower()}", message)
+        return {}
 
-        data_subset = {key: data[key] for key in data if key in sheetnames}
-        return data_subset
+    def open_gazetteer(self, resource: Resource, iso: str) -> Dict:
+        return self.open_gazetteers([resource], iso)
 
     def get_pcodes_from_gazetteer(self, data, iso, dataset):
         dataset_date = dataset.get_time_period(date_format="%Y-%m-%d")["startdate_str"]
 
         for sheetname in data:
-            adm_pcodes = list()
-            adm_duplicate_check = list()
-            skip_level = False
             if iso == "BMU" and sheetname == "_Admin 2":
                 continue
             if iso == "MSR" and "_pop" in sheetname:
                 continue
-            level = re.search("([^\d]\d[^\d])|([^\d]\d$)|(^\d[^\d])", sheetname)
+            level = re.search(r"([^\d]\d[^\d])|([^\d]\d$)|(^\d[^\d])", sheetname)
             if not level:
                 self._error_handler.add_message(
                     "PCodes",
@@ -135,276 +658,427 @@ class Pcodes:
                     f"Could not determine admin level for {sheetname}",
                 )
                 continue
-            level = re.search("\d", level.group()).group()
+            level = re.search(r"\d", level.group()).group()
 
             df = data[sheetname]
-            codeheaders = [
-                h
-                for h in df.columns
-                if bool(re.match(f".*{level}.*code?", h, re.IGNORECASE))
-                and "unhcr" not in h.lower()
-            ]
-            nameheaders = [
-                h
-                for h in df.columns
-                if (
-                    bool(
-                        re.match(
-                            "adm(in)?" + level + "(name)?_?([a-z]{2}$|name$)",
-                            h.strip(),
-                            re.IGNORECASE,
-                        )
-                    )
-                    or bool(re.match(f"name_?{level}", h, re.IGNORECASE))
-                )
-                and not bool(re.search("alt", h, re.IGNORECASE))
-            ]
-            if iso == "CMR":
-                nameheaders = [f"adm{level}_name1"]
-            if iso == "EGY" and level == "3":
-                nameheaders = ["ADM3_AR"]
-            parentlevel = int(level) - 1
-            if iso == "ARM" and level == "3":
-                parentlevel = 1
-            parentheaders = []
-            if int(level) > 1:
-                parentheaders = [
-                    h
-                    for h in df.columns
-                    if bool(re.match(f".*{parentlevel}.*code?", h, re.IGNORECASE))
-                    and "unhcr" not in h.lower()
-                ]
-            dateheaders = [h for h in df.columns if h.lower() == "validon"]
-
-            if len(codeheaders) == 0:
-                codeheaders = [
-                    h
-                    for h in df.columns
-                    if bool(re.match(".*pcode?", h, re.IGNORECASE))
-                ]
-                if len(codeheaders) != 1:
-                    self._error_handler.add_message(
-                        "PCodes",
-                        dataset["name"],
-                        f"Can't find code header at adm{level}",
-                    )
-                    continue
-
-            if len(codeheaders) > 1:
-                pcodeheaders = [c for c in codeheaders if "pcode" in c.lower()]
-                if len(pcodeheaders) >= 1:
-                    codeheaders = [pcodeheaders[0]]
-                else:
-                    self._error_handler.add_message(
-                        "PCodes",
-                        dataset["name"],
-                        f"Found multiple code columns at adm{level}, using first",
-                        message_type="warning",
-                    )
-                    codeheaders = [codeheaders[0]]
-
-            if len(nameheaders) == 0:
+            overrides = get_overrides(
+                self._configuration["header_overrides"], iso, level
+            )
+            mapping = resolve_headers(
+                tuple(df.columns),
+                level,
+                tuple(self._configuration["non_latin_alphabets"]),
+                tuple(sorted(overrides.items())),
+            )
+            self.header_mappings.setdefault(iso, {})[sheetname] = mapping
+            for text, message_type in mapping.messages:
                 self._error_handler.add_message(
-                    "PCodes", dataset["name"], f"Can't find name header at adm{level}"
+                    "PCodes", dataset["name"], text, message_type=message_type
                 )
+            if mapping.code is None or mapping.name is None:
                 continue
+            headers = [mapping.code, mapping.name]
+            if mapping.parent is not None:
+                headers.append(mapping.parent)
+            headers.extend(mapping.dates)
 
-            if len(nameheaders) > 1:
-                ennameheaders = [n for n in nameheaders if n[-3:].lower() == "_en"]
-                if len(ennameheaders) == 1:
-                    nameheaders = ennameheaders
-                else:
-                    latin_nameheaders = [
-                        n
-                        for n in nameheaders
-                        if n[-3] == "_"
-                        and n[-2:].lower()
-                        not in self._configuration["non_latin_alphabets"]
-                    ]
-                    if len(latin_nameheaders) > 0:
-                        nameheaders = [latin_nameheaders[0]]
-                    else:
-                        self._error_handler.add_message(
-                            "PCodes",
-                            dataset["name"],
-                            f"Found only non-latin alphabet name columns at adm{level}",
-                            message_type="warning",
-                        )
-                        nameheaders = [nameheaders[0]]
-
-            if len(parentheaders) == 0 and int(level) > 1:
-                self._error_handler.add_message(
-                    "PCodes",
-                    dataset["name"],
-                    f"Can't find parent code header at adm{level}",
-                )
+            if self._legacy_rows:
+                get_rows = self._get_rows_legacy
+            else:
+                get_rows = self._get_rows_vectorized
+            adm_pcodes, duplicates = get_rows(
+                df[headers],
+                mapping.parent is not None,
+                len(mapping.dates),
+                mapping.clean_names,
+                iso,
+                level,
+                dataset,
+                dataset_date,
+            )
 
-            if len(parentheaders) > 1 and int(level) > 1:
-                self._error_handler.add_message(
+            if duplicates:
+                self._error_handler.add_multi_valued_message(
                     "PCodes",
                     dataset["name"],
-                    f"Found multiple parent code columns at adm{level}, using first",
-                    message_type="warning",
+                    f"duplicate p-codes found at adm{level}",
+                    [f"{code} ({count} times)" for code, count in duplicates.items()],
                 )
-                parentheaders = [parentheaders[0]]
+            else:
+                self._add_pcodes(iso, adm_pcodes)
+        return
 
-            if len(dateheaders) == 0:
-                self._error_handler.add_message(
+    def _get_rows_legacy(
+        self,
+        df: DataFrame,
+        has_parent: bool,
+        no_dates: int,
+        clean_names: bool,
+        iso: str,
+        level: str,
+        dataset: Dataset,
+        dataset_date: str,
+    ) -> Tuple[List[Dict], Dict[str, int]]:
+        """Extract p-code rows from an admin sheet one row at a time. The columns
+        of df are code and name followed by parent and date where available."""
+        adm_pcodes = []
+        index = _AdminLevelIndex()
+        for _, row in df.iterrows():
+            row = row.to_numpy()
+            if "#" in str(row[0]):
+                continue
+            code = str(row[0])
+            if code in ["None", "", " ", "-"] or code.lower() == "not reported":
+                continue
+            if iso == "ECU" and code in ["ECISLA", "ECNO APLICA"]:
+                continue
+            index.add_codes((code,))
+            name = row[1]
+            if isna(name) or name == " ":
+                self._error_handler.add_missing_value_message(
                     "PCodes",
                     dataset["name"],
-                    f"Can't find date header at adm{level}, using dataset reference date",
-                    message_type="warning",
+                    f"admin {level} name",
+                    code,
                 )
+                name = None
+            if name and clean_names:
+                name = self.name_normalizer.normalize(name)
+            row_date = ""
+            if no_dates == 1:
+                row_date = _format_date(row[-1])
+            if no_dates == 0:
+                row_date = dataset_date
 
-            for _, row in df[
-                codeheaders + nameheaders + parentheaders + dateheaders
-            ].iterrows():
-                if "#" in str(row[codeheaders[0]]):
-                    continue
-                code = str(row[codeheaders[0]])
-                if code in ["None", "", " ", "-"] or code.lower() == "not reported":
-                    continue
-                if iso == "ECU" and code in ["ECISLA", "ECNO APLICA"]:
-                    continue
-                if code in adm_duplicate_check:
-                    skip_level = True
-                else:
-                    adm_duplicate_check.append(code)
-                name = row[nameheaders[0]]
-                if isna(name) or name == " ":
-                    self._error_handler.add_missing_value_message(
-                        "PCodes",
-                        dataset["name"],
-                        f"admin {level} name",
-                        code,
-                    )
-                    name = None
-                if name and not (iso == "EGY" and level == "3"):
-                    name = (
-                        normalize("NFKD", str(name))
-                        .encode("ascii", "ignore")
-                        .decode("ascii")
-                    )
-                    name = name.strip()
-                    if name.islower() or name.isupper():
-                        name = name.title()
-                row_date = ""
-                if len(dateheaders) == 1:
-                    row_date = row[dateheaders[0]]
-                    if isinstance(row_date, Timestamp):
-                        row_date = row_date.strftime("%Y-%m-%d")
-                    elif isinstance(row_date, int):
-                        row_date = xldate_as_datetime(row_date, 0)
-                        row_date = row_date.strftime("%Y-%m-%d")
-                if len(dateheaders) == 0:
-                    row_date = dataset_date
-
-                row_parent = iso
-                if len(parentheaders) == 1:
-                    row_parent = str(row[parentheaders[0]])
-                pcode = {
-                    "Location": iso,
-                    "Admin Level": level,
-                    "P-Code": code,
-                    "Name": name,
-                    "Parent P-Code": row_parent,
-                    "Valid from date": row_date,
-                }
-                if pcode not in adm_pcodes:
-                    adm_pcodes.append(pcode)
-
-            if skip_level:
-                self._error_handler.add_message(
-                    "PCodes", dataset["name"], f"Duplicate p-codes found at adm{level}"
-                )
-            else:
-                for adm_pcode in adm_pcodes:
-                    dict_of_lists_add(self.pcodes, iso, adm_pcode)
-        return
+            row_parent = iso
+            if has_parent:
+                row_parent = str(row[2])
+            pcode = {
+                "Location": iso,
+                "Admin Level": level,
+                "P-Code": code,
+                "Name": name,
+                "Parent P-Code": row_parent,
+                "Valid from date": row_date,
+            }
+            if index.add_row(tuple(pcode.values())):
+                adm_pcodes.append(pcode)
+        return adm_pcodes, index.get_duplicates()
+
+    def _get_rows_vectorized(
+        self,
+        df: DataFrame,
+        has_parent: bool,
+        no_dates: int,
+        clean_names: bool,
+        iso: str,
+        level: str,
+        dataset: Dataset,
+        dataset_date: str,
+    ) -> Tuple[List[Dict], Dict[str, int]]:
+        """Extract p-code rows from an admin sheet column by column. Gives the same
+        output as _get_rows_legacy: to_numpy applies the same type coercion as
+        iterrows, so each cell is converted exactly as in the per-row path."""
+        values = df.to_numpy()
+        codes = Series(values[:, 0], dtype=object).map(str)
+        keep = ~(
+            codes.str.contains("#", regex=False)
+            | codes.isin(["None", "", " ", "-"])
+            | (codes.str.lower() == "not reported")
+        )
+        if iso == "ECU":
+            keep &= ~codes.isin(["ECISLA", "ECNO APLICA"])
+        keep = keep.to_numpy()
+        values = values[keep]
+        codes = codes[keep].tolist()
+        index = _AdminLevelIndex()
+        index.add_codes(codes)
+
+        names = values[:, 1]
+        missing = isna(names) | (names == " ")
+        for code in compress(codes, missing):
+            self._error_handler.add_missing_value_message(
+                "PCodes",
+                dataset["name"],
+                f"admin {level} name",
+                code,
+            )
+        names = [None if m else name for name, m in zip(names, missing)]
+        if clean_names:
+            names = self.name_normalizer.normalize_names(names)
+
+        if no_dates == 1:
+            formatted = {}
+            dates = []
+            for row_date in values[:, -1]:
+                key = (type(row_date), row_date)
+                if key not in formatted:
+                    formatted[key] = _format_date(row_date)
+                dates.append(formatted[key])
+        elif no_dates == 0:
+            dates = [dataset_date] * len(codes)
+        else:
+            dates = [""] * len(codes)
+
+        if has_parent:
+            parents = Series(values[:, 2], dtype=object).map(str).tolist()
+        else:
+            parents = [iso] * len(codes)
+
+        adm_pcodes = [
+            {
+                "Location": iso,
+                "Admin Level": level,
+                "P-Code": code,
+                "Name": name,
+                "Parent P-Code": parent,
+                "Valid from date": row_date,
+            }
+            for code, name, parent, row_date in zip(codes, names, parents, dates)
+            if index.add_row((code, name, parent, row_date))
+        ]
+        return adm_pcodes, index.get_duplicates()
 
     def check_parents(self, iso: str) -> None:
+        """Check the hierarchy of a country's p-codes in linear time, recording
+        parents that are missing, parents that are not at the admin level expected
+        from the header overrides (by default one above their children) and cycles
+        in the integrity report"""
         if iso not in self.pcodes:
             return None
-        all_pcodes = [pcode["P-Code"] for pcode in self.pcodes[iso]]
-        parent_pcodes = set(
-            [
-                pcode["Parent P-Code"]
-                for pcode in self.pcodes[iso]
-                if int(pcode["Admin Level"]) > 1
-            ]
-        )
-        for pcode in parent_pcodes:
-            if pcode not in all_pcodes:
-                self._error_handler.add_missing_value_message(
-                    "PCodes",
-                    f"cod-ab-{iso.lower()}",
-                    "parent pcode",
-                    pcode,
+        pcodes = self.pcodes[iso]
+        codes = pcodes.get_column("P-Code")
+        levels = [int(level) for level in pcodes.get_column("Admin Level")]
+        parents = pcodes.get_column("Parent P-Code")
+        code_levels = dict(zip(codes, levels))
+        expected_parent_levels = {}
+        missing_parents = {}
+        wrong_level_parents = []
+        for code, level, parent in zip(codes, levels, parents):
+            if level < 2:
+                continue
+            expected_parent_level = expected_parent_levels.get(level)
+            if expected_parent_level is None:
+                overrides = get_overrides(
+                    self._configuration["header_overrides"], iso, str(level)
                 )
+                expected_parent_level = int(overrides.get("parent_level", level - 1))
+                expected_parent_levels[level] = expected_parent_level
+            parent_level = code_levels.get(parent)
+            if parent_level is None:
+                dict_of_lists_add(missing_parents, parent, code)
+            elif parent_level != expected_parent_level:
+                wrong_level_parents.append(
+                    {
+                        "P-Code": code,
+                        "Admin Level": level,
+                        "Parent P-Code": parent,
+                        "Parent Admin Level": parent_level,
+                    }
+                )
+        for pcode in missing_parents:
+            self._error_handler.add_missing_value_message(
+                "PCodes",
+                f"cod-ab-{iso.lower()}",
+                "parent pcode",
+                pcode,
+            )
+        self.integrity[iso] = {
+            "Units": len(codes),
+            "Missing parents": [
+                {"Parent P-Code": parent, "Orphans": orphans}
+                for parent, orphans in missing_parents.items()
+            ],
+            "Wrong level parents": wrong_level_parents,
+            "Cycles": _find_cycles(dict(zip(codes, parents))),
+        }
         return None
 
+    def write_integrity_report(self, path: str) -> None:
+        """Write the hierarchy integrity report for all countries as JSON"""
+        report = {iso: self.integrity[iso] for iso in sorted(self.integrity)}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        no_issues = sum(
+            1
+            for country in report.values()
+            if any(country[key] for key in _INTEGRITY_ISSUES)
+        )
+        logger.info(
+            f"Integrity report: {no_issues} of {len(report)} countries have "
+            f"hierarchy issues"
+        )
+
     def get_pcode_lengths(self, iso) -> None:
-        if iso not in self.pcodes:
+        """Get the lengths of the country codes that start a country's p-codes and
+        of the part each p-code adds to its parent at each admin level, with the
+        number of p-codes of each length. The p-code columns are counted in one
+        pass by length, so only the few distinct combinations of lengths are
+        looked at individually. Countries whose p-codes start with country codes
+        of different lengths get a warning."""
+        pcodes = self.pcodes.get(iso)
+        if not pcodes:
             return None
-        pcode_lengths = {
-            "Location": iso,
-            "Country Length": None,
-            "Admin 1 Length": set(),
-            "Admin 2 Length": set(),
-            "Admin 3 Length": set(),
-            "Admin 4 Length": set(),
-            "Admin 5 Length": set(),
+        codes = pcodes.get_column("P-Code")
+        parents = pcodes.get_column("Parent P-Code")
+        starts = list(map(itemgetter(slice(3)), codes))
+        start_lengths = {
+            start: _get_country_code_length(start) for start in set(starts)
         }
-        country_code = None
-        for row in self.pcodes[iso]:
-            if not country_code:
-                country_code = row["P-Code"][:3]
-                country_info = Country.get_country_info_from_iso3(country_code)
-                if not country_info:
-                    country_code = row["P-Code"][:2]
-                    country_info = Country.get_country_info_from_iso2(country_code)
-                if not country_info:
-                    country_code = ""
-            if not pcode_lengths["Country Length"]:
-                pcode_lengths["Country Length"] = len(country_code)
-
-            field = f"Admin {row['Admin Level']} Length"
-            pcode = row["P-Code"]
-            parent_pcode = row["Parent P-Code"]
-            if row["Admin Level"] == "1":
-                parent_pcode = country_code
-
-            field_length = len(str(pcode)) - len(str(parent_pcode))
-            dict_of_sets_add(pcode_lengths, field, str(field_length))
-
-        for admin_level in range(1, 6):
-            field_lengths = pcode_lengths[f"Admin {admin_level} Length"]
-            if len(field_lengths) == 0:
-                field_lengths = None
-            else:
-                field_lengths = "|".join(field_lengths)
-            pcode_lengths[f"Admin {admin_level} Length"] = field_lengths
+        # P-codes with missing parents have no length and are left out
+        parent_lengths = {parent: len(parent) for parent in set(parents) if parent}
+        counts = Counter(
+            zip(
+                pcodes.get_column("Admin Level"),
+                map(len, codes),
+                map(parent_lengths.get, parents),
+                map(start_lengths.get, starts),
+            )
+        )
+        country_counts = Counter()
+        level_counts = {
+            str(level): Counter() for level in range(1, _MAX_ADMIN_LEVEL + 1)
+        }
+        for (level, length, parent_length, country_length), count in counts.items():
+            country_counts[country_length] += count
+            if level == "1":
+                parent_length = country_length
+            if parent_length is None or level not in level_counts:
+                continue
+            level_counts[level][length - parent_length] += count
+
+        pcode_lengths = {"Location": iso}
+        joined, joined_counts = _join_length_counts(country_counts)
+        pcode_lengths["Country Length"] = joined
+        pcode_lengths["Country Length Counts"] = joined_counts
+        if len(country_counts) > 1:
+            self._error_handler.add_message(
+                "PCodes",
+                f"cod-ab-{iso.lower()}",
+                f"p-codes start with country codes of lengths {joined}",
+                message_type="warning",
+            )
+        for level, lengths in level_counts.items():
+            joined, joined_counts = _join_length_counts(lengths)
+            pcode_lengths[f"Admin {level} Length"] = joined
+            pcode_lengths[f"Admin {level} Length Counts"] = joined_counts
 
         self.pcode_lengths.append(pcode_lengths)
         return None
 
-    def generate_dataset(self) -> Dataset:
-        global_pcodes = []
-        for _, rows in self.pcodes.items():
-            for row in rows:
-                global_pcodes.append(row)
-
-        global_pcodes = sorted(
-            global_pcodes,
-            key=lambda k: (
-                k["Location"],
-                k["Admin Level"],
-                k["P-Code"],
-            ),
-        )
+    def iterate_sorted_pcodes(self) -> Iterator[Dict]:
+        """Iterate over p-codes sorted by location, admin level and p-code, sorting
+        one country at a time. Countries spilled to disk are read back one at a
+        time, already sorted."""
+        for iso in sorted(self.pcodes):
+            yield from self.pcodes[iso].iterate_sorted()
+
+    def write_pcodes(self) -> Tuple[Optional[str], List[Tuple[Dict, str, int]]]:
+        """Write the p-code files for all levels and levels 1 and 2 in one pass.
+        Returns the earliest valid from date and the resource information, path and
+        number of rows of each file."""
+        headers = self._configuration["headers"]
+        resource_infos = [
+            self._configuration["resource_info_all"],
+            self._configuration["resource_info_1_2"],
+        ]
+        paths = [join(self._temp_folder, info["name"]) for info in resource_infos]
+        no_rows = [0, 0]
+        min_date = None
+        with ExitStack() as stack:
+            writers = []
+            for path in paths:
+                file = stack.enter_context(
+                    open(path, "w", encoding="utf-8-sig", newline="")
+                )
+                writer = DictWriter(file, headers, extrasaction="ignore")
+                writer.writeheader()
+                writers.append(writer)
+            for row in self.iterate_sorted_pcodes():
+                writers[0].writerow(row)
+                no_rows[0] += 1
+                if row["Admin Level"] in ["1", "2"]:
+                    writers[1].writerow(row)
+                    no_rows[1] += 1
+                row_date = row["Valid from date"]
+                if min_date is None or row_date < min_date:
+                    min_date = row_date
+        return min_date, list(zip(resource_infos, paths, no_rows))
+
+    def write_pcode_index(self, path: str) -> None:
+        """Write a SQLite index of all p-codes that can be queried with
+        PcodeIndex"""
+        with self.report.stage("write_pcode_index"):
+            write_index(path, self.iterate_sorted_pcodes())
+
+    def write_outputs(self, csv_path: str) -> List[Tuple[Dict, str, str]]:
+        """Write the other formats of all p-codes configured in outputs, skipping
+        those whose writer's package is not installed. csv_path is the CSV of all
+        p-codes. Returns the resource information, path and format of each
+        file."""
+        files = []
+        for output in self._configuration["outputs"]:
+            writer = output["writer"]
+            resource_info = output["resource_info"]
+            if not is_writer_available(writer):
+                logger.warning(
+                    f"Not writing {resource_info['name']} as {WRITER_PACKAGES[writer]}"
+                    " is not installed"
+                )
+                continue
+            path = join(self._temp_folder, resource_info["name"])
+            if writer == "csv.gz":
+                compress_gzip(csv_path, path)
+            elif writer == "csv.zst":
+                compress_zstd(csv_path, path)
+            else:
+                write_parquet(
+                    path,
+                    (self.pcodes[iso].iterate_sorted() for iso in sorted(self.pcodes)),
+                )
+            files.append((resource_info, path, output["format"]))
+        return files
+
+    def download_published_pcodes(self) -> Optional[str]:
+        """Download the global p-codes last published in HDX, returning the path
+        or None if they could not be downloaded or, when using saved data, were
+        not saved"""
+        name = self._configuration["resource_info_all"]["name"]
+        try:
+            dataset = self._read_dataset(self._configuration["dataset_name"])
+            if dataset:
+                for resource in dataset.get_resources():
+                    if resource["name"] != name:
+                        continue
+                    path = self._retriever.download_file(
+                        resource["url"], filename=f"published_{name}"
+                    )
+                    if exists(path):
+                        return path
+                    logger.warning(f"Published {name} not found in {path}")
+                    return None
+        except (HDXError, DownloadError, OSError):
+            logger.exception(f"Could not download published {name}")
+            return None
+        logger.warning(f"Could not find published {name}")
+        return None
 
-        adm12_pcodes = [g for g in global_pcodes if g["Admin Level"] in ["1", "2"]]
+    def write_changes(self, previous_path: str) -> Tuple[Dict, str, int]:
+        """Write the changes since previously published p-codes. Returns the
+        resource information, path and number of rows of the file."""
+        resource_info = self._configuration["resource_info_changes"]
+        path = join(self._temp_folder, resource_info["name"])
+        changes = get_changes(previous_path, self.iterate_sorted_pcodes())
+        log_changes(changes)
+        with open(path, "w", encoding="utf-8-sig", newline="") as file:
+            writer = DictWriter(file, self._configuration["headers_changes"])
+            writer.writeheader()
+            writer.writerows(changes)
+        return resource_info, path, len(changes)
 
+    def generate_dataset(self, previous_path: Optional[str] = None) -> Dataset:
+        """Generate the dataset, with a resource of the changes since the p-codes
+        in previous_path if given"""
         dataset = Dataset(
             {
                 "name": self._configuration["dataset_name"],
@@ -414,34 +1088,51 @@ class Pcodes:
         dataset.add_other_location("world")
         dataset.add_tags(self._configuration["tags"])
 
-        min_date = min([entry["Valid from date"] for entry in global_pcodes])
+        with self.report.stage("write_pcodes"):
+            min_date, files = self.write_pcodes()
         dataset.set_time_period(startdate=min_date, ongoing=True)
 
-        headers = self._configuration["headers"]
-        dataset.generate_resource(
-            folder=self._temp_folder,
-            filename=self._configuration["resource_info_all"]["name"],
-            rows=global_pcodes,
-            resourcedata=self._configuration["resource_info_all"],
-            headers=headers,
-            encoding="utf-8-sig",
-        )
-        dataset.generate_resource(
-            folder=self._temp_folder,
-            filename=self._configuration["resource_info_1_2"]["name"],
-            rows=adm12_pcodes,
-            resourcedata=self._configuration["resource_info_1_2"],
-            headers=headers,
-            encoding="utf-8-sig",
-        )
+        for resource_info, path, no_rows in files:
+            if no_rows == 0:
+                logger.error(f"No data rows in {resource_info['name']}!")
+                remove(path)
+                continue
+            resource = Resource(resource_info)
+            resource.set_format("csv")
+            resource.set_file_to_upload(path)
+            dataset.add_update_resource(resource)
+
+        _, csv_path, no_rows = files[0]
+        if no_rows:
+            with self.report.stage("write_outputs"):
+                outputs = self.write_outputs(csv_path)
+            for resource_info, path, file_format in outputs:
+                resource = Resource(resource_info)
+                try:
+                    resource.set_format(file_format)
+                except HDXError:
+                    logger.exception(f"Not adding {resource_info['name']}")
+                    continue
+                resource.set_file_to_upload(path)
+                dataset.add_update_resource(resource)
+
+        if previous_path:
+            with self.report.stage("write_changes"):
+                resource_info, path, _ = self.write_changes(previous_path)
+            resource = Resource(resource_info)
+            resource.set_format("csv")
+            resource.set_file_to_upload(path)
+            dataset.add_update_resource(resource)
+
         headers = self._configuration["headers_lengths"]
-        dataset.generate_resource(
-            folder=self._temp_folder,
-            filename=self._configuration["resource_info_lengths"]["name"],
-            rows=self.pcode_lengths,
-            resourcedata=self._configuration["resource_info_lengths"],
-            headers=headers,
-            encoding="utf-8-sig",
-        )
+        with self.report.stage("write_pcode_lengths"):
+            dataset.generate_resource(
+                folder=self._temp_folder,
+                filename=self._configuration["resource_info_lengths"]["name"],
+                rows=self.pcode_lengths,
+                resourcedata=self._configuration["resource_info_lengths"],
+                headers=headers,
+                encoding="utf-8-sig",
+            )
 
         return dataset
@@ -0,0 +1,171 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from os import makedirs, remove, replace
+from os.path import exists, getsize
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+from time import sleep
+from typing import Iterator, List
+from urllib.parse import urlsplit
+
+from hdx.utilities.retriever import Retrieve
+from requests import HTTPError
+
+logger = logging.getLogger(__name__)
+
+
+def _is_client_error(ex: OSError) -> bool:
+    return (
+        isinstance(ex, HTTPError)
+        and ex.response is not None
+        and 400 <= ex.response.status_code < 500
+    )
+
+
+class GazetteerPrefetcher:
+    """Downloads gazetteers ahead of parsing in a pool of threads sharing the
+    connection pool of the Retrieve object's session. At most per_host downloads
+    run at once from any host. Failed downloads are retried, resuming partial
+    files where the server supports ranges. Files are saved where Retrieve would
+    save them, and if Retrieve uses saved data nothing is downloaded.
+
+    Args:
+        retriever (Retrieve): Retrieve object
+        workers (int): Number of concurrent downloads. Defaults to 4.
+        per_host (int): Maximum concurrent downloads per host. Defaults to 2.
+        retries (int): Number of retries of a failed download. Defaults to 3.
+        backoff (float): Seconds to wait before first retry, doubling each time. Defaults to 1.
+        timeout (float): Timeout in seconds of connecting and reading. Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        retriever: Retrieve,
+        workers: int = 4,
+        per_host: int = 2,
+        retries: int = 3,
+        backoff: float = 1,
+        timeout: float = 60,
+    ):
+        self._retriever = retriever
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = Lock()
+        self._host_limits = defaultdict(lambda: BoundedSemaphore(per_host))
+        self._futures = {}
+        self.downloaded = 0
+        self.resumed = 0
+        self.retried = 0
+
+    def __enter__(self) -> "GazetteerPrefetcher":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, url: str) -> Future:
+        """Start downloading url if it is not already downloading"""
+        with self._lock:
+            future = self._futures.get(url)
+            if future is None:
+                if self._retriever.use_saved:
+                    future = Future()
+                    future.set_result(self._retriever.download_file(url))
+                else:
+                    future = self._executor.submit(self._download, url)
+                self._futures[url] = future
+            return future
+
+    def prefetch(self, urls: List[str]) -> None:
+        for url in urls:
+            self.submit(url)
+
+    def get(self, url: str) -> Path:
+        """Get the path of a downloaded file, waiting for its download to finish.
+        Urls that were not prefetched or failed to download are downloaded by
+        Retrieve."""
+        future = self._futures.get(url)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                logger.exception(f"Prefetch of {url} failed, downloading again")
+        return self._retriever.download_file(url)
+
+    def iterate_completed(self, urls: List[str]) -> Iterator[str]:
+        """Iterate over urls in the order in which their downloads finish"""
+        futures = {self.submit(url): url for url in urls}
+        for future in as_completed(futures):
+            yield futures[future]
+
+    def _get_path(self, url: str) -> Path:
+        filename, _ = self._retriever.get_filename(url)
+        if self._retriever.save:
+            folder = self._retriever.saved_dir
+        else:
+            folder = self._retriever.temp_dir
+        makedirs(folder, exist_ok=True)
+        return folder / filename
+
+    def _download(self, url: str) -> Path:
+        path = self._get_path(url)
+        partial_path = path.with_name(f"{path.name}.part")
+        if exists(partial_path):
+            remove(partial_path)
+        host = urlsplit(url).netloc
+        with self._lock:
+            host_limit = self._host_limits[host]
+        with host_limit:
+            for attempt in range(self._retries + 1):
+                try:
+                    self._download_to(url, partial_path)
+                    break
+                except OSError as ex:
+                    if attempt == self._retries or _is_client_error(ex):
+                        raise
+                    delay = self._backoff * 2**attempt
+                    logger.warning(f"Download of {url} failed ({ex}), retrying")
+                    with self._lock:
+                        self.retried += 1
+                    sleep(delay)
+        replace(partial_path, path)
+        with self._lock:
+            self.downloaded += 1
+        return path
+
+    def _download_to(self, url: str, partial_path: Path) -> None:
+        session = self._retriever.downloader.session
+        headers = {}
+        position = getsize(partial_path) if exists(partial_path) else 0
+        if position:
+            headers["Range"] = f"bytes={position}-"
+        with session.get(
+            url, headers=headers, stream=True, timeout=self._timeout
+        ) as response:
+            response.raise_for_status()
+            if position and response.status_code == 206:
+                mode = "ab"
+                with self._lock:
+                    self.resumed += 1
+            else:
+                mode = "wb"
+            expected = response.headers.get("Content-Length")
+            written = 0
+            with open(partial_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    written += len(chunk)
+            if expected is not None and written < int(expected):
+                raise OSError(f"Received {written} of {expected} bytes")
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Prefetched {self.downloaded} gazetteers, {self.retried} retries, "
+            f"{self.resumed} resumed"
+        )
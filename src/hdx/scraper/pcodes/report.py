@@ -0,0 +1,225 @@
+import cProfile
+import json
+import logging
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from csv import DictWriter
+from threading import Lock, local
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
+
+try:
+    from resource import RUSAGE_SELF, getrusage
+except ImportError:
+    getrusage = None
+
+try:
+    from os import sysconf
+except ImportError:
+    sysconf = None
+
+logger = logging.getLogger(__name__)
+
+_GLOBAL = "global"  # Location of stages not tied to a country
+
+_CSV_HEADERS = (
+    "Location",
+    "Stage",
+    "Time",
+    "Process Peak RSS",
+    "Peak Traced",
+    "Rows",
+    "Bytes Downloaded",
+)
+
+
+def _get_peak_rss() -> Optional[int]:
+    if getrusage is None:
+        return None
+    peak_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak_rss
+    return peak_rss * 1024
+
+
+def get_rss() -> Optional[int]:
+    """Get the resident set size of the process in bytes where /proc is available,
+    otherwise the peak resident set size"""
+    if sysconf is None:
+        return _get_peak_rss()
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return _get_peak_rss()
+    return pages * sysconf("SC_PAGE_SIZE")
+
+
+class RunReport:
+    """Wall time and memory of each stage of a run for each country, with the rows
+    produced and bytes downloaded. Process peak RSS is the peak resident set size
+    of the main process since it started, read at the end of a stage, so it never
+    goes down from one stage to the next. If trace_memory is True, the peak memory
+    allocated during each stage, including the stages nested in it, is also
+    measured with tracemalloc. This slows the run and only isolates stages when
+    countries are processed one at a time.
+
+    Args:
+        trace_memory (bool): Measure memory with tracemalloc. Defaults to False.
+        profile_iso (Optional[str]): Country to profile with cProfile. Defaults to None.
+        profile_path (str): Path for profile stats. Defaults to "pcodes.prof".
+    """
+
+    def __init__(
+        self,
+        trace_memory: bool = False,
+        profile_iso: Optional[str] = None,
+        profile_path: str = "pcodes.prof",
+    ):
+        self._trace_memory = trace_memory
+        self._profile_iso = profile_iso
+        self._profile_path = profile_path
+        self._lock = Lock()
+        self._locations = {}
+        self._local = local()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _get_location(self, iso: Optional[str]) -> Dict:
+        iso = iso or _GLOBAL
+        with self._lock:
+            location = self._locations.get(iso)
+            if location is None:
+                location = self._locations[iso] = {
+                    "Location": iso,
+                    "Rows": 0,
+                    "Bytes Downloaded": 0,
+                    "Stages": {},
+                }
+            return location
+
+    def _get_traced_peaks(self) -> List[int]:
+        """Peaks traced before the last reset of each stage open in this
+        thread"""
+        if not hasattr(self._local, "traced_peaks"):
+            self._local.traced_peaks = []
+        return self._local.traced_peaks
+
+    @contextmanager
+    def stage(self, name: str, iso: Optional[str] = None) -> Iterator[None]:
+        """Measure a stage for a country or, if iso is None, the whole run. The
+        times of stages run more than once are added together. The tracemalloc
+        peak is reset at the start of each stage, so the peak of the stage it is
+        nested in is saved first and restored when it ends."""
+        if self._trace_memory:
+            traced_peaks = self._get_traced_peaks()
+            if traced_peaks:
+                traced_peaks[-1] = max(
+                    traced_peaks[-1], tracemalloc.get_traced_memory()[1]
+                )
+            traced_peaks.append(0)
+            tracemalloc.reset_peak()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            time = perf_counter() - start
+            peak_rss = _get_peak_rss()
+            peak_traced = None
+            if self._trace_memory:
+                peak_traced = max(
+                    traced_peaks.pop(), tracemalloc.get_traced_memory()[1]
+                )
+                if traced_peaks:
+                    traced_peaks[-1] = max(traced_peaks[-1], peak_traced)
+            location = self._get_location(iso)
+            with self._lock:
+                stage = location["Stages"].get(name)
+                if stage is None:
+                    location["Stages"][name] = {
+                        "Time": time,
+                        "Process Peak RSS": peak_rss,
+                        "Peak Traced": peak_traced,
+                    }
+                else:
+                    stage["Time"] += time
+                    stage["Process Peak RSS"] = peak_rss
+                    if peak_traced is not None:
+                        stage["Peak Traced"] = max(stage["Peak Traced"], peak_traced)
+
+    @contextmanager
+    def profile(self, iso: str) -> Iterator[None]:
+        """Profile with cProfile if iso is the country to profile"""
+        if iso != self._profile_iso:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self._profile_path)
+            logger.info(f"Saved profile of {iso} to {self._profile_path}")
+
+    def set_rows(self, iso: str, rows: int) -> None:
+        self._get_location(iso)["Rows"] = rows
+
+    def add_bytes(self, iso: str, no_bytes: int) -> None:
+        location = self._get_location(iso)
+        with self._lock:
+            location["Bytes Downloaded"] += no_bytes
+
+    def get_locations(self) -> Dict[str, Dict]:
+        return self._locations
+
+    def get_time(self, iso: str) -> float:
+        """Total time of a country"""
+        stages = self._locations[iso]["Stages"]
+        if "total" in stages:
+            return stages["total"]["Time"]
+        return sum(stage["Time"] for stage in stages.values())
+
+    def write(self, path: str) -> None:
+        """Write report to JSON or, if path ends with .csv, CSV with one row per
+        stage"""
+        if path.lower().endswith(".csv"):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = DictWriter(f, _CSV_HEADERS)
+                writer.writeheader()
+                for location in self._locations.values():
+                    for name, stage in location["Stages"].items():
+                        writer.writerow(
+                            {
+                                "Location": location["Location"],
+                                "Stage": name,
+                                "Rows": location["Rows"],
+                                "Bytes Downloaded": location["Bytes Downloaded"],
+                                **stage,
+                            }
+                        )
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(list(self._locations.values()), f, indent=2)
+        logger.info(f"Wrote run report to {path}")
+
+    def log_summary(self, top: int = 10) -> None:
+        countries = [iso for iso in self._locations if iso != _GLOBAL]
+        countries = sorted(countries, key=self.get_time, reverse=True)[:top]
+        if not countries:
+            return
+        logger.info(f"{len(countries)} slowest countries:")
+        for iso in countries:
+            location = self._locations[iso]
+            stages = {
+                name: stage["Time"]
+                for name, stage in location["Stages"].items()
+                if name != "total"
+            }
+            slowest = max(stages, key=stages.get) if stages else "none"
+            logger.info(
+                f"{iso}: {self.get_time(iso):.2f}s, {location['Rows']} rows, "
+                f"{location['Bytes Downloaded'] / 1e6:.1f} MB downloaded, "
+                f"slowest stage {slowest} ({stages.get(slowest, 0):.2f}s)"
+            )
@@ -0,0 +1,103 @@
+import json
+import logging
+from math import inf
+from os import makedirs
+from os.path import exists, join
+from typing import List, Optional
+
+from hdx.api.locations import Locations
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.data.vocabulary import Vocabulary
+from hdx.location.country import Country
+from hdx.utilities.base_downloader import BaseDownload
+
+from hdx.scraper.pcodes.countries import load_countries
+from hdx.scraper.pcodes.datasets import DatasetIndex
+
+logger = logging.getLogger(__name__)
+
+_COUNTRIES = "countries.json.gz"
+_HDX_LOOKUPS = "hdx_lookups.json"
+_OUTPUT = "output"
+
+
+class Snapshot:
+    """Folder of everything a run reads from HDX and the web, so that the run can
+    be replayed with no network access. Recording saves the COD-AB datasets, the
+    published global p-codes dataset, the country data and the HDX formats,
+    tags and locations used to build the dataset. Downloaded files are saved in
+    the same folder by a Retrieve object using it as saved_dir. Replaying reads
+    all of these from the folder instead.
+
+    Args:
+        folder (str): Folder of snapshot
+        replay (bool): Read from the snapshot rather than record it. Defaults to False.
+    """
+
+    def __init__(self, folder: str, replay: bool = False):
+        self.folder = folder
+        self.replay = replay
+        if not replay:
+            makedirs(folder, exist_ok=True)
+
+    def get_output_folder(self) -> str:
+        """Get the folder in which a replay writes its outputs"""
+        folder = join(self.folder, _OUTPUT)
+        makedirs(folder, exist_ok=True)
+        return folder
+
+    def read_hdx_lookups(self) -> None:
+        """Read the HDX formats, tags, approved vocabulary and locations from HDX
+        and save them or, when replaying, set them from the snapshot"""
+        path = join(self.folder, _HDX_LOOKUPS)
+        if self.replay:
+            if not exists(path):
+                logger.warning(f"No HDX lookups in {path}, they will be read from HDX")
+                return
+            with open(path, encoding="utf-8") as f:
+                lookups = json.load(f)
+            Resource._formats_dict = lookups["formats"]
+            Vocabulary._tags_dict = lookups["tags"]
+            Vocabulary._approved_vocabulary = Vocabulary(lookups["approved_vocabulary"])
+            Locations.set_validlocations(lookups["locations"])
+            return
+        lookups = {
+            "formats": Resource.read_formats_mappings(),
+            "tags": Vocabulary.read_tags_mappings(),
+            "approved_vocabulary": Vocabulary.get_approved_vocabulary().data,
+            "locations": Locations.validlocations(),
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(lookups, f, ensure_ascii=False)
+
+    def load_countries(self, downloader: BaseDownload) -> List[str]:
+        """Load Country data, from the OCHA countries feed when recording and
+        from the snapshot when replaying. If the feed could not be read when
+        recording, Country's static file is used in both."""
+        path = join(self.folder, _COUNTRIES)
+        if not self.replay:
+            return load_countries(path, 0, downloader)
+        if exists(path):
+            return load_countries(path, inf, downloader)
+        Country.countriesdata(use_live=False)
+        return list(Country.countriesdata()["countries"])
+
+    def read_datasets(self) -> DatasetIndex:
+        """Index the COD-AB datasets read from HDX or the snapshot"""
+        if self.replay:
+            return DatasetIndex.load_from_json(self.folder)
+        return DatasetIndex.read_from_hdx(folder=self.folder)
+
+    def read_dataset(self, name: str) -> Optional[Dataset]:
+        """Read a dataset from HDX or the snapshot. A dataset not found when
+        recording is not found when replaying."""
+        path = join(self.folder, f"dataset-{name}.json")
+        if self.replay:
+            if not exists(path):
+                return None
+            return Dataset.load_from_json(path)
+        dataset = Dataset.read_from_hdx(name)
+        if dataset:
+            dataset.save_to_json(path)
+        return dataset
@@ -0,0 +1,119 @@
+import gzip
+import json
+import logging
+from os import replace
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from hdx.api.configuration import Configuration
+from hdx.data.dataset import Dataset
+
+from hdx.scraper.pcodes.cache import CACHE_VERSION, columns_to_rows, rows_to_columns
+
+logger = logging.getLogger(__name__)
+
+# Configuration that affects the rows produced for a country
+_STATE_CONFIGURATION = (
+    "header_overrides",
+    "missing_units",
+    "non_latin_alphabets",
+    "resource_exceptions",
+)
+
+
+class RunState:
+    """State of the previous run stored in a gzipped JSON file. For each country
+    it holds the modified time and resource ids of the COD-AB dataset, the p-code
+    rows and the error handler calls made while getting them. Countries whose
+    dataset has not been modified since the previous run can reuse these rows.
+    The state is discarded if the configuration or code version has changed.
+
+    Args:
+        path (str): Path to state file
+        configuration (Configuration): HDX configuration
+    """
+
+    def __init__(self, path: str, configuration: Configuration):
+        self._path = path
+        self._configuration = [
+            CACHE_VERSION,
+            {key: configuration[key] for key in _STATE_CONFIGURATION},
+        ]
+        self._modified_times = {}
+        self._lock = Lock()
+        self.reused = 0
+        self.updated = 0
+        self._countries = {}
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        if state["configuration"] == json.loads(json.dumps(self._configuration)):
+            self._countries = state["countries"]
+        else:
+            logger.info("Configuration changed since previous run, ignoring state")
+
+    def read_modified_times(self) -> None:
+        """Read the modified times of all COD-AB datasets in one search"""
+        datasets = Dataset.search_in_hdx(
+            fq="name:cod-ab-*", fl="name,metadata_modified"
+        )
+        self._modified_times = {
+            dataset["name"][7:].upper(): dataset["metadata_modified"]
+            for dataset in datasets
+        }
+
+    def set_modified_times(self, modified_times: Dict[str, str]) -> None:
+        self._modified_times = modified_times
+
+    def is_unchanged(self, iso: str) -> bool:
+        country = self._countries.get(iso)
+        if not country:
+            return False
+        return country["metadata_modified"] == self._modified_times.get(iso)
+
+    def get_unchanged(self, iso: str) -> Optional[Tuple[List[Dict], List]]:
+        """Get rows and error handler calls for a country from the previous run or
+        None if its dataset has changed since then"""
+        if not self.is_unchanged(iso):
+            return None
+        country = self._countries[iso]
+        with self._lock:
+            self.reused += 1
+        return columns_to_rows(country["columns"]), country["calls"]
+
+    def set_country(
+        self, iso: str, dataset: Optional[Dataset], rows: List[Dict], calls: List
+    ) -> None:
+        if dataset:
+            metadata_modified = dataset.get("metadata_modified")
+            resources = [resource["id"] for resource in dataset.get_resources()]
+        else:
+            metadata_modified = None
+            resources = []
+        self._countries[iso] = {
+            "metadata_modified": metadata_modified,
+            "resources": resources,
+            "row_count": len(rows),
+            "columns": rows_to_columns(rows),
+            "calls": calls,
+        }
+        with self._lock:
+            self.updated += 1
+
+    def save(self) -> None:
+        temp_path = f"{self._path}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump(
+                {"configuration": self._configuration, "countries": self._countries},
+                f,
+                default=str,
+            )
+        replace(temp_path, self._path)
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Incremental run: {self.updated} countries updated, "
+            f"{self.reused} countries reused from previous run"
+        )
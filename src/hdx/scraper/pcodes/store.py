@@ -0,0 +1,149 @@
+import json
+from sys import getsizeof
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+FIELDS = (
+    "Location",
+    "Admin Level",
+    "P-Code",
+    "Name",
+    "Parent P-Code",
+    "Valid from date",
+)
+
+
+class CountryPcodes(Sequence):
+    """P-codes of one country stored as one list per field rather than one dict per
+    unit. Equal strings are stored once per country, so the values that repeat on
+    every row like location, admin level and date, and parent p-codes, which are
+    also p-codes, take no extra memory. Indexing and iterating give rows as dicts
+    built on the fly: changing them does not change the stored values.
+
+    Args:
+        rows (Iterable[Dict]): Rows to add. Defaults to no rows.
+    """
+
+    __slots__ = ("_columns", "_strings")
+
+    def __init__(self, rows: Iterable[Dict] = ()):
+        self._columns = tuple([] for _ in FIELDS)
+        self._strings = {}
+        self.extend(rows)
+
+    @classmethod
+    def from_columns(cls, columns: Sequence[List]) -> "CountryPcodes":
+        """Create from one list of values per field in the order of FIELDS. The
+        lists are stored as they are, without interning their strings."""
+        pcodes = cls()
+        pcodes._columns = tuple(columns)
+        return pcodes
+
+    def _intern(self, value):
+        if not isinstance(value, str):
+            return value
+        return self._strings.setdefault(value, value)
+
+    def append(self, row: Dict) -> None:
+        for column, field in zip(self._columns, FIELDS):
+            column.append(self._intern(row.get(field)))
+
+    def extend(self, rows: Iterable[Dict]) -> None:
+        for row in rows:
+            self.append(row)
+
+    def get_column(self, field: str) -> List:
+        """Get the values of a field. The returned list must not be modified."""
+        return self._columns[FIELDS.index(field)]
+
+    def get_size(self) -> int:
+        """Get the number of bytes taken by the lists of values, by each
+        distinct value stored in them and by the dict used to intern strings"""
+        values = {id(value): value for column in self._columns for value in column}
+        return (
+            sum(getsizeof(column) for column in self._columns)
+            + sum(getsizeof(value) for value in values.values())
+            + getsizeof(self._strings)
+        )
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def __getitem__(self, index: int) -> Dict:
+        return dict(zip(FIELDS, (column[index] for column in self._columns)))
+
+    def __iter__(self) -> Iterator[Dict]:
+        for values in zip(*self._columns):
+            yield dict(zip(FIELDS, values))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CountryPcodes):
+            return self._columns == other._columns
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"CountryPcodes({list(self)!r})"
+
+    def _get_sorted_indices(self) -> List[int]:
+        levels = self.get_column("Admin Level")
+        codes = self.get_column("P-Code")
+        return sorted(range(len(self)), key=lambda i: (levels[i], codes[i]))
+
+    def iterate_sorted(self) -> Iterator[Dict]:
+        """Iterate over rows sorted by admin level and p-code"""
+        for index in self._get_sorted_indices():
+            yield self[index]
+
+    def get_sorted_columns(self) -> Tuple[List, ...]:
+        """Get the values of each field with rows sorted by admin level and
+        p-code"""
+        indices = self._get_sorted_indices()
+        return tuple([column[i] for i in indices] for column in self._columns)
+
+
+class SpilledCountryPcodes(Sequence):
+    """P-codes of one country written to a JSON file of columns so that they take
+    no memory until read. Rows are written sorted by admin level and p-code.
+    Every access reads the whole file, so rows are best read in one go with
+    iterate_sorted or load.
+
+    Args:
+        path (str): Path of file to write
+        pcodes (CountryPcodes): P-codes to write
+    """
+
+    __slots__ = ("_path", "_length")
+
+    def __init__(self, path: str, pcodes: CountryPcodes):
+        self._path = path
+        self._length = len(pcodes)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(pcodes.get_sorted_columns(), f, ensure_ascii=False)
+
+    def load(self) -> CountryPcodes:
+        """Read the p-codes back into memory"""
+        with open(self._path, encoding="utf-8") as f:
+            return CountryPcodes.from_columns(json.load(f))
+
+    def get_column(self, field: str) -> List:
+        return self.load().get_column(field)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> Dict:
+        return self.load()[index]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.load())
+
+    def __eq__(self, other) -> bool:
+        return self.load() == other
+
+    def __repr__(self) -> str:
+        return f"SpilledCountryPcodes({self._path!r})"
+
+    def iterate_sorted(self) -> Iterator[Dict]:
+        """Iterate over rows sorted by admin level and p-code"""
+        return iter(self.load())
@@ -0,0 +1,82 @@
+import json
+import logging
+import platform
+from datetime import datetime, timezone
+from glob import glob
+from os import getenv, makedirs
+from os.path import join
+from statistics import mean
+from time import perf_counter
+
+import pytest
+
+logger = logging.getLogger(__name__)
+
+# Results are saved here, one JSON file per run, and compared with the last run
+_BENCHMARK_DIR = getenv("BENCHMARK_DIR", ".benchmarks")
+# Benchmarks this many times slower than in the last run are reported
+_REGRESSION_RATIO = float(getenv("BENCHMARK_REGRESSION_RATIO", "1.2"))
+# Benchmarks faster than this in seconds are too noisy to compare
+_MIN_TIME = 0.01
+
+
+@pytest.fixture(scope="session")
+def benchmark_results():
+    results = {}
+    yield results
+    if not results:
+        return
+    makedirs(_BENCHMARK_DIR, exist_ok=True)
+    paths = sorted(glob(join(_BENCHMARK_DIR, "*.json")))
+    previous = {}
+    if paths:
+        with open(paths[-1]) as f:
+            previous = json.load(f)["results"]
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        change = result["min"] / previous[name]["min"]
+        result["change"] = change
+        if change > _REGRESSION_RATIO and result["min"] > _MIN_TIME:
+            logger.warning(
+                f"Benchmark {name} regressed: {result['min']:.3f}s against "
+                f"{previous[name]['min']:.3f}s in {paths[-1]}"
+            )
+    now = datetime.now(timezone.utc)
+    path = join(_BENCHMARK_DIR, f"{now:%Y%m%dT%H%M%S}.json")
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "datetime": now.isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    logger.info(f"Saved benchmark results to {path}")
+
+
+@pytest.fixture
+def benchmark(benchmark_results, request):
+    """Time a function over a number of rounds, calling setup before each round,
+    and record the result under the test name"""
+
+    def run(func, *args, rounds=3, setup=None, **kwargs):
+        times = []
+        for _ in range(rounds):
+            if setup:
+                setup()
+            start = perf_counter()
+            result = func(*args, **kwargs)
+            times.append(perf_counter() - start)
+        benchmark_results[request.node.name] = {
+            "min": min(times),
+            "mean": mean(times),
+            "rounds": rounds,
+        }
+        logger.info(f"Benchmark {request.node.name}: {min(times):.3f}s")
+        return result
+
+    return run
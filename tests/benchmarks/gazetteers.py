@@ -0,0 +1,142 @@
+"""Synthetic gazetteers for benchmarks. Workbooks have one sheet per admin level
+with p-codes, names in one or more scripts, parent p-codes and, except in the
+lower header style, a validOn date."""
+
+from datetime import datetime
+from typing import List, Sequence, Tuple
+
+import xlwt
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.location.country import Country
+from pandas import DataFrame, ExcelWriter
+
+SCRIPTS = {
+    "latin": ("en", ("ka", "bu", "la", "mi", "ro", "sa", "te", "no", "di", "ga")),
+    "accented": ("fr", ("ká", "bü", "lâ", "mï", "rõ", "ša", "tè", "ñó", "dí", "gå")),
+    "arabic": ("ar", ("كا", "بو", "لا", "مي", "رو", "سا", "تي", "نو", "دي", "غا")),
+    "cyrillic": ("ru", ("ка", "бу", "ла", "ми", "ро", "са", "те", "но", "ди", "га")),
+}
+
+HEADER_STYLES = ("cod", "admin", "lower")
+
+VALID_ON = datetime(2024, 1, 1)
+
+
+def _get_headers(
+    header_style: str, level: int, languages: Sequence[str]
+) -> Tuple[str, List[str], str]:
+    if header_style == "cod":
+        return (
+            f"ADM{level}_PCODE",
+            [f"ADM{level}_{language.upper()}" for language in languages],
+            f"ADM{level - 1}_PCODE",
+        )
+    if header_style == "admin":
+        return (
+            f"admin{level}Pcode",
+            [f"admin{level}Name_{language}" for language in languages],
+            f"admin{level - 1}Pcode",
+        )
+    if header_style == "lower":
+        return (
+            f"adm{level}_pcode",
+            [f"adm{level}_{language}" for language in languages],
+            f"adm{level - 1}_pcode",
+        )
+    raise ValueError(f"Unknown header style {header_style}")
+
+
+def _get_name(syllables: Sequence[str], level: int, index: int) -> str:
+    name = "".join(syllables[int(digit)] for digit in f"{level}{index}")
+    if index % 3 == 0:
+        return name.upper()
+    return name.capitalize()
+
+
+def generate_gazetteer(
+    iso: str,
+    rows: Sequence[int] = (10, 100, 1000),
+    scripts: Sequence[str] = ("latin",),
+    header_style: str = "cod",
+) -> List[Tuple[str, DataFrame]]:
+    """Generate the admin sheets of a gazetteer. The number of admin levels is the
+    length of rows, which gives the number of units at each level. Units are
+    assigned to parents in turn.
+
+    Args:
+        iso (str): ISO3 code of country
+        rows (Sequence[int]): Number of units at each admin level
+        scripts (Sequence[str]): Scripts of name columns. Keys of SCRIPTS.
+        header_style (str): One of HEADER_STYLES
+
+    Returns:
+        List[Tuple[str, DataFrame]]: Sheet names and sheets
+    """
+    prefix = Country.get_iso2_from_iso3(iso) or iso[:2]
+    languages = [SCRIPTS[script][0] for script in scripts]
+    sheets = []
+    parents = [prefix]
+    for level, no_units in enumerate(rows, start=1):
+        code_header, name_headers, parent_header = _get_headers(
+            header_style, level, languages
+        )
+        width = max(2, len(str(-(-no_units // len(parents)))))
+        codes = [
+            f"{parents[index % len(parents)]}{index // len(parents) + 1:0{width}d}"
+            for index in range(no_units)
+        ]
+        columns = {code_header: codes}
+        for name_header, script in zip(name_headers, scripts):
+            syllables = SCRIPTS[script][1]
+            columns[name_header] = [
+                _get_name(syllables, level, index) for index in range(no_units)
+            ]
+        if level > 1:
+            columns[parent_header] = [
+                parents[index % len(parents)] for index in range(no_units)
+            ]
+        if header_style != "lower":
+            columns["validOn"] = [VALID_ON] * no_units
+        sheets.append((f"{iso.lower()}_adm{level}", DataFrame(columns)))
+        parents = codes
+    return sheets
+
+
+def write_gazetteer(path: str, sheets: List[Tuple[str, DataFrame]]) -> None:
+    """Write sheets from generate_gazetteer to an xlsx or xls workbook"""
+    if path.endswith(".xlsx"):
+        with ExcelWriter(path, engine="openpyxl") as writer:
+            for sheetname, df in sheets:
+                df.to_excel(writer, sheet_name=sheetname, index=False)
+        return
+    workbook = xlwt.Workbook(encoding="utf-8")
+    date_style = xlwt.easyxf(num_format_str="YYYY-MM-DD")
+    for sheetname, df in sheets:
+        worksheet = workbook.add_sheet(sheetname)
+        for column, header in enumerate(df.columns):
+            worksheet.write(0, column, header)
+            for row, value in enumerate(df[header], start=1):
+                if isinstance(value, datetime):
+                    worksheet.write(row, column, value, date_style)
+                else:
+                    worksheet.write(row, column, value)
+    workbook.save(path)
+
+
+def generate_dataset(iso: str, file_format: str = "xlsx") -> Dataset:
+    """Generate a COD-AB dataset with a gazetteer resource"""
+    dataset = Dataset({"name": f"cod-ab-{iso.lower()}", "cod_level": "cod-standard"})
+    dataset.set_time_period("2024-01-01")
+    filename = f"{iso.lower()}_adminboundaries_tabulardata.{file_format}"
+    resource = Resource(
+        {
+            "name": filename,
+            "description": f"{iso} administrative boundaries gazetteer",
+            "url": f"https://data.humdata.org/dataset/cod-ab-{iso.lower()}"
+            f"/resource/{iso.lower()}/download/{filename}",
+        }
+    )
+    resource.set_format(file_format)
+    dataset.add_update_resource(resource)
+    return dataset
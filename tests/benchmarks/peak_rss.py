@@ -0,0 +1,81 @@
+"""Process the gazetteers and datasets saved in a folder in a new interpreter, so
+that the peak resident set size is that of one run, and print the resident set
+size before processing, the peak, the bytes of p-codes kept in memory after
+processing and the number of rows written as JSON.
+
+Usage: python peak_rss.py FOLDER MEMORY_LIMIT
+
+A memory limit of -1 means no limit."""
+
+import json
+import sys
+from glob import glob
+from os.path import basename, dirname, join
+
+from hdx.api.configuration import Configuration
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+from hdx.location.country import Country
+from hdx.utilities.downloader import Download
+from hdx.utilities.retriever import Retrieve
+
+from hdx.scraper.pcodes.datasets import DatasetIndex
+from hdx.scraper.pcodes.pcodes import Pcodes
+from hdx.scraper.pcodes.report import _get_peak_rss, get_rss
+from hdx.scraper.pcodes.store import CountryPcodes
+
+_CONFIG_DIR = join(dirname(__file__), "..", "..", "src", "hdx", "scraper", "pcodes")
+
+
+def main(folder: str, memory_limit: int) -> None:
+    Configuration._create(
+        hdx_read_only=True,
+        hdx_site="prod",
+        user_agent="test",
+        project_config_yaml=join(_CONFIG_DIR, "config", "project_configuration.yaml"),
+    )
+    Country.countriesdata(False)
+    datasets = DatasetIndex.load_from_json(folder)
+    countries = [
+        basename(path)[15:18].upper()
+        for path in sorted(glob(join(folder, "dataset-cod-ab-*.json")))
+    ]
+    with HDXErrorHandler() as error_handler:
+        with Download(user_agent="test") as downloader:
+            retriever = Retrieve(
+                downloader=downloader,
+                fallback_dir=folder,
+                saved_dir=folder,
+                temp_dir=folder,
+                save=False,
+                use_saved=True,
+            )
+            pcodes = Pcodes(
+                configuration=Configuration.read(),
+                retriever=retriever,
+                temp_folder=folder,
+                error_handler=error_handler,
+                datasets=datasets,
+                memory_limit=None if memory_limit < 0 else memory_limit,
+            )
+            rss = get_rss()
+            pcodes.process_countries(countries)
+            kept = sum(
+                rows.get_size()
+                for rows in pcodes.pcodes.values()
+                if isinstance(rows, CountryPcodes)
+            )
+            _, files = pcodes.write_pcodes()
+    print(
+        json.dumps(
+            {
+                "rss": rss,
+                "peak_rss": _get_peak_rss(),
+                "kept": kept,
+                "rows": files[0][2],
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,221 @@
+import json
+import subprocess
+import sys
+from os import environ, getenv, pathsep
+from os.path import dirname, join
+
+import pytest
+from gazetteers import generate_dataset, generate_gazetteer, write_gazetteer
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+from hdx.location.country import Country
+from hdx.utilities.downloader import Download
+from hdx.utilities.retriever import Retrieve
+
+from hdx.scraper.pcodes.datasets import DatasetIndex
+from hdx.scraper.pcodes.pcodes import Pcodes
+
+pytestmark = pytest.mark.benchmark
+
+# Units at each admin level of the large gazetteer
+_ROWS = tuple(int(x) for x in getenv("BENCHMARK_ROWS", "30,300,3000,30000").split(","))
+# Countries in the world run and units at each of their admin levels
+_COUNTRIES = int(getenv("BENCHMARK_COUNTRIES", "20"))
+_COUNTRY_ROWS = (10, 100, 1000)
+# Countries in the memory limit run and units at each of their admin levels
+_MEMORY_COUNTRIES = int(getenv("BENCHMARK_MEMORY_COUNTRIES", "10"))
+_MEMORY_ROWS = (20, 200, 2000, 20000)
+
+_ISO = "AFG"
+
+
+@pytest.fixture(scope="session")
+def saved_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def retriever(configuration, saved_dir):
+    with Download(user_agent="test") as downloader:
+        yield Retrieve(
+            downloader=downloader,
+            fallback_dir=saved_dir,
+            saved_dir=saved_dir,
+            temp_dir=saved_dir,
+            save=False,
+            use_saved=True,
+        )
+
+
+def _write_gazetteer(retriever, saved_dir, dataset, sheets):
+    filename, _ = retriever.get_filename(dataset.get_resource()["url"])
+    write_gazetteer(join(saved_dir, filename), sheets)
+
+
+@pytest.fixture
+def make_pcodes(configuration, retriever, saved_dir):
+    with HDXErrorHandler() as error_handler:
+        yield lambda **kwargs: Pcodes(
+            configuration=configuration,
+            retriever=retriever,
+            temp_folder=saved_dir,
+            error_handler=error_handler,
+            **kwargs,
+        )
+
+
+@pytest.fixture
+def pcodes(make_pcodes):
+    return make_pcodes()
+
+
+@pytest.fixture(scope="session", params=["xlsx", "xls"])
+def gazetteer(request, retriever, saved_dir):
+    dataset = generate_dataset(_ISO, request.param)
+    sheets = generate_gazetteer(_ISO, _ROWS, ("latin", "arabic"))
+    _write_gazetteer(retriever, saved_dir, dataset, sheets)
+    return dataset
+
+
+@pytest.fixture
+def data(pcodes, gazetteer):
+    return pcodes.open_gazetteer(gazetteer.get_resource(), _ISO)
+
+
+@pytest.fixture
+def loaded_pcodes(pcodes, gazetteer, data):
+    pcodes.get_pcodes_from_gazetteer(data, _ISO, gazetteer)
+    return pcodes
+
+
+class TestBenchmarks:
+    def test_open_gazetteer(self, benchmark, pcodes, gazetteer):
+        data = benchmark(pcodes.open_gazetteer, gazetteer.get_resource(), _ISO)
+        assert [len(df) for df in data.values()] == list(_ROWS)
+
+    @pytest.mark.parametrize("legacy_rows", [False, True])
+    def test_get_pcodes_from_gazetteer(
+        self, benchmark, make_pcodes, gazetteer, data, legacy_rows
+    ):
+        pcodes = make_pcodes(legacy_rows=legacy_rows)
+        benchmark(
+            pcodes.get_pcodes_from_gazetteer,
+            data,
+            _ISO,
+            gazetteer,
+            setup=lambda: pcodes.pcodes.pop(_ISO, None),
+        )
+        assert len(pcodes.pcodes[_ISO]) == sum(_ROWS)
+
+    def test_check_parents(self, benchmark, loaded_pcodes):
+        benchmark(loaded_pcodes.check_parents, _ISO)
+        assert loaded_pcodes.integrity[_ISO]["Missing parents"] == []
+
+    def test_get_pcode_lengths(self, benchmark, loaded_pcodes):
+        benchmark(
+            loaded_pcodes.get_pcode_lengths,
+            _ISO,
+            setup=loaded_pcodes.pcode_lengths.clear,
+        )
+        assert loaded_pcodes.pcode_lengths[0][f"Admin {len(_ROWS)} Length"]
+
+    def test_generate_dataset(self, benchmark, loaded_pcodes):
+        loaded_pcodes.get_pcode_lengths(_ISO)
+        dataset = benchmark(loaded_pcodes.generate_dataset)
+        assert [
+            resource["name"]
+            for resource in dataset.get_resources()
+            if resource["format"] == "csv"
+        ] == [
+            "global_pcodes.csv",
+            "global_pcodes_adm_1_2.csv",
+            "global_pcode_lengths.csv",
+        ]
+
+    def test_import_main(self, benchmark):
+        benchmark(
+            subprocess.run,
+            [sys.executable, "-c", "import hdx.scraper.pcodes.__main__"],
+            check=True,
+            env={**environ, "PYTHONPATH": pathsep.join(sys.path)},
+            rounds=5,
+        )
+
+    def test_world(self, benchmark, configuration, make_pcodes, retriever, saved_dir):
+        countries = [
+            iso
+            for iso in sorted(Country.countriesdata()["countries"])
+            if iso not in configuration["header_overrides"]
+        ][:_COUNTRIES]
+        datasets = []
+        for i, iso in enumerate(countries):
+            dataset = generate_dataset(iso, ("xlsx", "xls")[i % 2])
+            sheets = generate_gazetteer(
+                iso,
+                _COUNTRY_ROWS,
+                (("latin",), ("accented", "cyrillic"))[i % 2],
+                ("cod", "admin", "lower")[i % 3],
+            )
+            _write_gazetteer(retriever, saved_dir, dataset, sheets)
+            datasets.append(dataset)
+        pcodes = make_pcodes(datasets=DatasetIndex(datasets))
+
+        def setup():
+            pcodes.pcodes.clear()
+            pcodes.pcode_lengths.clear()
+
+        def run():
+            pcodes.process_countries(countries)
+            return pcodes.generate_dataset()
+
+        benchmark(run, rounds=1, setup=setup)
+        assert len(pcodes.pcodes) == len(countries)
+
+
+def _get_peak_rss(folder, memory_limit):
+    """Run peak_rss.py in a new interpreter"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            join(dirname(__file__), "peak_rss.py"),
+            folder,
+            str(memory_limit),
+        ],
+        capture_output=True,
+        check=True,
+        env={**environ, "PYTHONPATH": pathsep.join(sys.path)},
+        text=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+@pytest.fixture(scope="session")
+def memory_dir(tmp_path_factory, configuration, retriever):
+    """Folder of large synthetic gazetteers with their datasets saved as JSON"""
+    folder = str(tmp_path_factory.mktemp("memory"))
+    countries = sorted(Country.countriesdata()["countries"])[:_MEMORY_COUNTRIES]
+    for iso in countries:
+        dataset = generate_dataset(iso, "xlsx")
+        filename, _ = retriever.get_filename(dataset.get_resource()["url"])
+        write_gazetteer(join(folder, filename), generate_gazetteer(iso, _MEMORY_ROWS))
+        dataset.save_to_json(join(folder, f"dataset-cod-ab-{iso.lower()}.json"))
+    return folder
+
+
+class TestMemoryLimit:
+    def test_memory_limit(self, memory_dir, record_property):
+        """Spilling every country leaves the memory needed to read one gazetteer,
+        and a limit of half the p-codes kept with no limit adds at most about the
+        limit to that peak"""
+        spilled = _get_peak_rss(memory_dir, 0)
+        unlimited = _get_peak_rss(memory_dir, -1)
+        memory_limit = unlimited["kept"] // 2
+        limited = _get_peak_rss(memory_dir, memory_limit)
+        for name, result in (
+            ("spilled", spilled),
+            ("unlimited", unlimited),
+            ("limited", limited),
+        ):
+            record_property(f"{name}_peak_rss", result["peak_rss"])
+        assert limited["peak_rss"] <= spilled["peak_rss"] + memory_limit * 1.1
+        rows = _MEMORY_COUNTRIES * sum(_MEMORY_ROWS)
+        assert spilled["rows"] == unlimited["rows"] == limited["rows"] == rows
@@ -3,11 +3,16 @@ from os.path import join
 import pytest
 from hdx.api.configuration import Configuration
 from hdx.api.locations import Locations
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
 from hdx.data.dataset import Dataset
 from hdx.data.vocabulary import Vocabulary
 from hdx.location.country import Country
+from hdx.utilities.downloader import Download
+from hdx.utilities.retriever import Retrieve
 from hdx.utilities.useragent import UserAgent
 
+from hdx.scraper.pcodes.pcodes import Pcodes
+
 
 @pytest.fixture(scope="session")
 def fixtures_dir():
@@ -24,6 +29,26 @@ def config_dir(fixtures_dir):
     return join("src", "hdx", "scraper", "pcodes", "config")
 
 
+@pytest.fixture(scope="session")
+def row():
+    """Function making a row of p-codes as kept for a country, named after its
+    p-code if no name is given"""
+
+    def make_row(
+        level, code, name=None, parent=None, location="XYZ", valid_from="2024-01-01"
+    ):
+        return {
+            "Location": location,
+            "Admin Level": str(level),
+            "P-Code": code,
+            "Name": code if name is None else name,
+            "Parent P-Code": parent,
+            "Valid from date": valid_from,
+        }
+
+    return make_row
+
+
 @pytest.fixture(scope="function")
 def read_dataset(monkeypatch):
     def read_from_hdx(dataset_name):
@@ -71,3 +96,52 @@ def configuration(config_dir):
         "name": "approved",
     }
     return Configuration.read()
+
+
+@pytest.fixture
+def temp_folder(tmp_path):
+    return str(tmp_path)
+
+
+@pytest.fixture
+def saved_dir(input_dir):
+    """Folder of the saved gazetteers read by retriever"""
+    return input_dir
+
+
+@pytest.fixture
+def retriever(saved_dir, temp_folder):
+    with Download(user_agent="test") as downloader:
+        yield Retrieve(
+            downloader=downloader,
+            fallback_dir=temp_folder,
+            saved_dir=saved_dir,
+            temp_dir=temp_folder,
+            save=False,
+            use_saved=True,
+        )
+
+
+@pytest.fixture
+def error_handler():
+    with HDXErrorHandler() as error_handler:
+        yield error_handler
+
+
+@pytest.fixture
+def make_pcodes(configuration, retriever, temp_folder, error_handler):
+    """Function making a Pcodes object reading the saved gazetteers, with keyword
+    arguments passed on to Pcodes"""
+
+    def make(**kwargs):
+        return Pcodes(
+            **{
+                "configuration": configuration,
+                "retriever": retriever,
+                "temp_folder": temp_folder,
+                "error_handler": error_handler,
+                **kwargs,
+            }
+        )
+
+    return make
@@ -0,0 +1,74 @@
+from os.path import join
+
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+from hdx.data.dataset import Dataset
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.cache import GazetteerCache
+
+
+class TestGazetteerCache:
+    def test_cache(self, configuration, input_dir):
+        dataset = Dataset.load_from_json(join(input_dir, "dataset-cod-ab-afg.json"))
+        resource = dataset.get_resource()
+        rows = [
+            {
+                "Location": "AFG",
+                "Admin Level": "1",
+                "P-Code": "AF01",
+                "Name": "Kabul",
+                "Parent P-Code": "AFG",
+                "Valid from date": "2021-11-17",
+            },
+            {
+                "Location": "AFG",
+                "Admin Level": "1",
+                "P-Code": "AF02",
+                "Name": None,
+                "Parent P-Code": "AFG",
+                "Valid from date": "2021-11-17",
+            },
+        ]
+        calls = [
+            ["add_missing_value_message", ["PCodes", "cod-ab-afg", "name", "AF02"], {}]
+        ]
+        with temp_dir("TestGazetteerCache") as tempdir:
+            cache = GazetteerCache(tempdir, 1024 * 1024)
+            key = cache.get_key("AFG", [resource], dataset, {"a": 1})
+            assert key.startswith("AFG-")
+            assert cache.get_key("AFG", [resource], dataset, {"a": 2}) != key
+            resource["last_modified"] = "2024-01-01T00:00:00"
+            assert cache.get_key("AFG", [resource], dataset, {"a": 1}) != key
+
+            assert cache.get(key) is None
+            cache.put(key, rows, calls)
+            assert cache.get(key) == (rows, calls)
+            assert (cache.hits, cache.misses) == (1, 1)
+
+            cache.clear("ARM")
+            assert cache.get(key) == (rows, calls)
+            cache.clear("AFG")
+            assert cache.get(key) is None
+
+            cache = GazetteerCache(tempdir, 1)
+            cache.put(key, rows, calls)
+            assert cache.get(key) is None
+            assert cache.evictions == 1
+
+    def test_pcodes_from_cache(
+        self, read_dataset, make_pcodes, error_handler, temp_folder
+    ):
+        cache = GazetteerCache(join(temp_folder, "cache"), 1024 * 1024)
+        pcodes = make_pcodes(cache=cache)
+        pcodes.process_countries(["AFG", "ARM"])
+        assert (cache.hits, cache.misses) == (0, 2)
+
+        with HDXErrorHandler() as cached_error_handler:
+            cached_pcodes = make_pcodes(
+                retriever=None, error_handler=cached_error_handler, cache=cache
+            )
+            cached_pcodes.process_countries(["AFG", "ARM"])
+        assert (cache.hits, cache.misses) == (2, 2)
+        assert cached_pcodes.pcodes == pcodes.pcodes
+        assert cached_pcodes.pcode_lengths == pcodes.pcode_lengths
+        assert cached_error_handler.shared_errors == error_handler.shared_errors
@@ -0,0 +1,136 @@
+from csv import DictReader, DictWriter
+from os.path import join
+
+import pytest
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.changes import get_changes
+from hdx.scraper.pcodes.store import FIELDS, CountryPcodes
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = DictWriter(f, FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+class TestChanges:
+    @pytest.fixture
+    def previous(self, row):
+        return [
+            row(1, "AB01", "East", "ABC", "ABC"),
+            row(1, "XY01", "North", "XYZ"),
+            row(1, "XY02", "South", "XYZ"),
+            row(2, "XY0101", "Riverside", "XY01"),
+            row(2, "XY0102", "Hill", "XY01"),
+            row(2, "XY0201", "Lake", "XY02"),
+        ]
+
+    @pytest.fixture
+    def rows(self, row):
+        return [
+            row(1, "XY01", "North", "XYZ"),
+            row(1, "XY02", "South", "XYZ"),
+            row(1, "XY03", "West", "XYZ"),
+            row(2, "XY0101", "Riverside", "XY01"),
+            row(2, "XY0102", "Hills", "XY02"),
+            row(2, "XY0201", "Lakeside", "XY02"),
+        ]
+
+    def test_get_changes(self, previous, rows):
+        with temp_dir("TestChanges") as tempdir:
+            path = join(tempdir, "previous.csv")
+            write_csv(path, previous)
+            changes = get_changes(path, rows)
+            assert get_changes(path, previous) == []
+        assert [
+            (change["Location"], change["Change"], change["P-Code"])
+            for change in changes
+        ] == [
+            ("ABC", "removed", "AB01"),
+            ("XYZ", "added", "XY03"),
+            ("XYZ", "renamed", "XY0102"),
+            ("XYZ", "reparented", "XY0102"),
+            ("XYZ", "renamed", "XY0201"),
+        ]
+        assert changes[0]["Name"] == "East"
+        assert changes[0]["Previous Name"] is None
+        assert changes[2] == {
+            "Location": "XYZ",
+            "Change": "renamed",
+            "Admin Level": "2",
+            "P-Code": "XY0102",
+            "Name": "Hills",
+            "Previous Name": "Hill",
+            "Parent P-Code": "XY02",
+            "Previous Parent P-Code": "XY01",
+        }
+
+    def test_get_changes_levels(self, row):
+        """A p-code repeated at two admin levels is compared at each level"""
+        previous = [
+            row(1, "XY01", "North", "XYZ"),
+            row(2, "XY01", "North", "XY01"),
+        ]
+        with temp_dir("TestChangesLevels") as tempdir:
+            path = join(tempdir, "previous.csv")
+            write_csv(path, previous)
+            assert get_changes(path, previous) == []
+            changes = get_changes(path, previous[:1])
+        assert [
+            (change["Change"], change["Admin Level"], change["P-Code"])
+            for change in changes
+        ] == [("removed", "2", "XY01")]
+
+    def test_generate_dataset_changes(self, make_pcodes, temp_folder, previous, rows):
+        pcodes = make_pcodes(retriever=None)
+        pcodes.pcodes["XYZ"] = CountryPcodes(rows)
+        pcodes.get_pcode_lengths("XYZ")
+        previous_path = join(temp_folder, "previous.csv")
+        write_csv(previous_path, previous)
+        dataset = pcodes.generate_dataset(previous_path)
+        assert [
+            resource["name"]
+            for resource in dataset.get_resources()
+            if resource["format"] == "csv"
+        ] == [
+            "global_pcodes.csv",
+            "global_pcodes_adm_1_2.csv",
+            "global_pcode_changes.csv",
+            "global_pcode_lengths.csv",
+        ]
+        with open(
+            join(temp_folder, "global_pcode_changes.csv"), encoding="utf-8-sig"
+        ) as f:
+            changes = list(DictReader(f))
+        assert len(changes) == 5
+        assert changes[2]["Previous Parent P-Code"] == "XY01"
+        assert changes[0]["Previous Name"] == ""
+
+    def test_no_published_pcodes(self, make_pcodes, rows, monkeypatch):
+        """With saved data, published p-codes that were not saved are skipped"""
+        published = Dataset({"name": "global-pcodes"})
+        published.add_update_resource(
+            Resource(
+                {
+                    "name": "global_pcodes.csv",
+                    "url": "http://test/pcodes.csv",
+                    "format": "csv",
+                }
+            )
+        )
+        monkeypatch.setattr(
+            Dataset, "read_from_hdx", staticmethod(lambda name: published)
+        )
+        pcodes = make_pcodes()
+        pcodes.pcodes["XYZ"] = CountryPcodes(rows)
+        pcodes.get_pcode_lengths("XYZ")
+        previous_path = pcodes.download_published_pcodes()
+        assert previous_path is None
+        dataset = pcodes.generate_dataset(previous_path)
+        assert "global_pcode_changes.csv" not in [
+            resource["name"] for resource in dataset.get_resources()
+        ]
@@ -0,0 +1,55 @@
+from os import utime
+from os.path import exists, join
+from time import time
+
+from hdx.location.country import Country
+from hdx.utilities.base_downloader import DownloadError
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.countries import load_countries
+
+
+class FailingDownload:
+    def __init__(self, downloader, failures):
+        self._downloader = downloader
+        self._failures = failures
+        self.calls = 0
+
+    def get_tabular_rows(self, url, **kwargs):
+        self.calls += 1
+        if self.calls <= self._failures:
+            raise DownloadError(f"Download of {url} failed")
+        return self._downloader.get_tabular_rows(Country._ochapath_default, **kwargs)
+
+
+class TestLoadCountries:
+    def test_load_countries(self, configuration, monkeypatch):
+        monkeypatch.setattr(Country, "_countriesdata", None)
+        monkeypatch.setattr(Country, "_use_live", True)
+        with temp_dir("TestLoadCountries") as tempdir:
+            path = join(tempdir, "countries", "countries.json.gz")
+            with Download(user_agent="test") as downloader:
+                failing = FailingDownload(downloader, 1)
+                countries = load_countries(path, 7, failing)
+                assert "AFG" in countries
+                assert failing.calls == 2
+                assert not exists(path)
+
+                monkeypatch.setattr(Country, "_countriesdata", None)
+                working = FailingDownload(downloader, 0)
+                assert load_countries(path, 7, working) == countries
+                assert working.calls == 1
+                assert exists(path)
+
+                monkeypatch.setattr(Country, "_countriesdata", None)
+                unused = FailingDownload(downloader, 2)
+                assert load_countries(path, 7, unused) == countries
+                assert unused.calls == 0
+                assert Country.get_iso3_from_iso2("AF") == "AFG"
+
+                old = time() - 8 * 86400
+                utime(path, (old, old))
+                monkeypatch.setattr(Country, "_countriesdata", None)
+                assert load_countries(path, 7, working) == countries
+                assert working.calls == 2
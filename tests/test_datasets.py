@@ -0,0 +1,37 @@
+from hdx.data.dataset import Dataset
+
+from hdx.scraper.pcodes.datasets import DatasetIndex
+
+
+class TestDatasetIndex:
+    def test_dataset_index(self, input_dir, make_pcodes, error_handler, monkeypatch):
+        datasets = DatasetIndex.load_from_json(input_dir)
+        assert datasets.get("AFG")["name"] == "cod-ab-afg"
+        assert datasets.get("MMR") is None
+        assert datasets.get_modified_times()["ARM"] == "2023-05-15T21:53:01.562402"
+
+        archived = Dataset({"name": "cod-ab-mmr", "cod_level": "cod-standard"})
+        archived["archived"] = True
+        no_level = Dataset({"name": "cod-ab-som", "metadata_modified": "2024"})
+        other = Dataset({"name": "wfp-food-prices-afg", "cod_level": "cod-standard"})
+        index = DatasetIndex([datasets.get("AFG"), archived, no_level, other])
+        assert index.get("AFG") is not None
+        assert index.get("MMR") is None
+        assert index.get("SOM") is None
+        assert index.get_modified_times() == {
+            "AFG": "2023-07-12T22:01:33.590027",
+            "MMR": None,
+            "SOM": "2024",
+        }
+
+        def read_from_hdx(name):
+            raise AssertionError(f"Unexpected read of {name}")
+
+        monkeypatch.setattr(Dataset, "read_from_hdx", staticmethod(read_from_hdx))
+        pcodes = make_pcodes(datasets=datasets)
+        pcodes.process_countries(["AFG", "ARM", "BES", "MMR"])
+        assert list(pcodes.pcodes) == ["AFG", "ARM"]
+        assert len(pcodes.pcodes["AFG"]) == 435
+        assert error_handler.shared_errors["warning"]["PCodes - MMR"] == {
+            "PCodes - MMR - Could not find dataset"
+        }
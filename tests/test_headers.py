@@ -0,0 +1,64 @@
+from hdx.scraper.pcodes.headers import (
+    get_override_columns,
+    get_overrides,
+    is_header_column,
+    resolve_headers,
+)
+
+
+class TestHeaders:
+    def test_resolve_headers(self, configuration):
+        non_latin_alphabets = tuple(configuration["non_latin_alphabets"])
+        columns = ("ADM2_EN", "ADM2_AR", "ADM2_PCODE", "ADM1_PCODE", "validOn")
+        mapping = resolve_headers(columns, "2", non_latin_alphabets)
+        assert mapping.code == "ADM2_PCODE"
+        assert mapping.name == "ADM2_EN"
+        assert mapping.parent == "ADM1_PCODE"
+        assert mapping.dates == ("validOn",)
+        assert mapping.clean_names is True
+        assert mapping.messages == ()
+        hits = resolve_headers.cache_info().hits
+        assert resolve_headers(columns, "2", non_latin_alphabets) is mapping
+        assert resolve_headers.cache_info().hits == hits + 1
+
+        mapping = resolve_headers(
+            ("admin3Name_ar", "admin3Name_ru", "admin3Pcode"),
+            "3",
+            non_latin_alphabets,
+        )
+        assert mapping.name == "admin3Name_ar"
+        assert mapping.parent is None
+        assert mapping.messages == (
+            ("Found only non-latin alphabet name columns at adm3", "warning"),
+            ("Can't find parent code header at adm3", "error"),
+            (
+                "Can't find date header at adm3, using dataset reference date",
+                "warning",
+            ),
+        )
+
+        mapping = resolve_headers(("ADM1_EN",), "1", non_latin_alphabets)
+        assert mapping.code is None
+        assert mapping.messages == (("Can't find code header at adm1", "error"),)
+
+    def test_overrides(self, configuration):
+        header_overrides = configuration["header_overrides"]
+        assert get_overrides(header_overrides, "CMR", "2") == {"name": "adm2_name1"}
+        assert get_overrides(header_overrides, "EGY", "3") == {
+            "name": "ADM3_AR",
+            "clean_names": False,
+        }
+        assert get_overrides(header_overrides, "EGY", "2") == {}
+        assert get_overrides(header_overrides, "AFG", "1") == {}
+        assert "adm3_name1" in get_override_columns(header_overrides, "CMR")
+        assert is_header_column("adm3_name1", ("adm3_name1",))
+        assert not is_header_column("adm3_name1")
+
+        overrides = get_overrides(header_overrides, "ARM", "3")
+        mapping = resolve_headers(
+            ("ADM3_PCODE", "ADM3_EN", "ADM2_PCODE", "ADM1_PCODE"),
+            "3",
+            tuple(configuration["non_latin_alphabets"]),
+            tuple(sorted(overrides.items())),
+        )
+        assert mapping.parent == "ADM1_PCODE"
@@ -0,0 +1,88 @@
+from os.path import join
+from time import perf_counter
+
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.index import PcodeIndex, write_index
+from hdx.scraper.pcodes.pcodes import Pcodes
+from hdx.scraper.pcodes.store import CountryPcodes
+
+
+class TestPcodeIndex:
+    def test_pcode_index(self, configuration, row):
+        rows = [
+            row(1, "XY01", "North", "XYZ"),
+            row(1, "XY02", "South", "XYZ"),
+            row(2, "XY0101", "Riverside", "XY01"),
+            row(2, "XY0102", "Hill", "XY01"),
+            row(3, "XY010101", "Riverside", "XY0101"),
+            row(1, "AB01", "North", "ABC", "ABC"),
+        ]
+        with HDXErrorHandler() as error_handler:
+            pcodes = Pcodes(
+                configuration=configuration,
+                retriever=None,
+                temp_folder="",
+                error_handler=error_handler,
+            )
+            pcodes.pcodes["XYZ"] = CountryPcodes(rows[:5])
+            pcodes.pcodes["ABC"] = CountryPcodes(rows[5:])
+            with temp_dir("TestPcodeIndex") as tempdir:
+                path = join(tempdir, "global_pcodes.sqlite")
+                pcodes.write_pcode_index(path)
+                with PcodeIndex(path) as index:
+                    assert index.get("XY0101") == rows[2]
+                    assert index.get("XY99") is None
+                    assert index.get_name("XY010101") == "Riverside"
+                    assert index.get_children("XY01") == rows[2:4]
+                    assert index.get_children("XYZ") == rows[:2]
+                    assert index.get_children("XY010101") == []
+                    assert index.get_ancestors("XY010101") == [rows[2], rows[0]]
+                    assert index.get_ancestors("XY01") == []
+                    assert index.find_by_name("riverside") == [rows[2], rows[4]]
+                    assert index.find_by_name("Riverside", admin_level=3) == [rows[4]]
+                    assert index.find_by_name("NORTH") == [rows[5], rows[0]]
+                    assert index.find_by_name("North", location="XYZ") == [rows[0]]
+
+    def test_pcode_index_cycle(self, row):
+        with temp_dir("TestPcodeIndexCycle") as tempdir:
+            path = join(tempdir, "index.sqlite")
+            rows = [row(2, "XY01", "A", "XY02"), row(1, "XY02", "B", "XY01")]
+            assert write_index(path, rows) == 2
+            with PcodeIndex(path) as index:
+                assert index.get_ancestors("XY01") == [rows[1]]
+                assert index.get_ancestors("XY02") == []
+
+    def test_pcode_index_levels(self, row):
+        """A p-code repeated at two admin levels"""
+        with temp_dir("TestPcodeIndexLevels") as tempdir:
+            path = join(tempdir, "index.sqlite")
+            rows = [
+                row(3, "XY0101", "Centre", "XY01"),
+                row(2, "XY01", "North City", "XY01"),
+                row(1, "XY01", "North", "XYZ"),
+            ]
+            assert write_index(path, rows) == 3
+            with PcodeIndex(path) as index:
+                assert index.get("XY01") == rows[2]
+                assert index.get("XY01", admin_level=2) == rows[1]
+                assert index.get("XY01", admin_level=3) is None
+                assert index.get_ancestors("XY0101") == [rows[1], rows[2]]
+                assert index.get_ancestors("XY01", admin_level=2) == [rows[2]]
+                assert index.get_ancestors("XY01") == []
+
+    def test_pcode_index_speed(self, row):
+        with temp_dir("TestPcodeIndexSpeed") as tempdir:
+            path = join(tempdir, "index.sqlite")
+            rows = (
+                row(2, f"XY{i:06d}", f"Name {i % 5000}", f"XY{i // 100:04d}")
+                for i in range(100000)
+            )
+            assert write_index(path, rows, batch_size=7000) == 100000
+            with PcodeIndex(path) as index:
+                start = perf_counter()
+                for i in range(0, 100000, 100):
+                    assert index.get_name(f"XY{i:06d}") == f"Name {i % 5000}"
+                    assert len(index.find_by_name(f"Name {i % 5000}")) == 20
+                assert (perf_counter() - start) / 2000 < 0.001
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from os import environ, pathsep
+
+# Modules that the CLI should only import once it runs
+_DEFERRED = (
+    "hdx.data.dataset",
+    "hdx.location.country",
+    "hdx.scraper.pcodes.pcodes",
+    "openpyxl",
+    "pandas",
+    "xlrd",
+)
+
+
+def get_import_times(module):
+    """Import a module in a new interpreter, returning the cumulative import time
+    in microseconds of each module imported as reported by python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        env={**environ, "PYTHONPATH": pathsep.join(sys.path)},
+        text=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+class TestMain:
+    def test_deferred_imports(self):
+        import_times = get_import_times("hdx.scraper.pcodes.__main__")
+        assert "hdx.scraper.pcodes.__main__" in import_times
+        assert [module for module in _DEFERRED if module in import_times] == []
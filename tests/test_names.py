@@ -0,0 +1,34 @@
+from pandas import Series
+
+from hdx.scraper.pcodes.names import NameNormalizer, clean_name
+
+
+class TestNames:
+    def test_clean_name(self):
+        assert clean_name(" KABUL ") == "Kabul"
+        assert clean_name("herat") == "Herat"
+        assert clean_name("Ğazni Şehri") == "Gazni Sehri"
+        assert clean_name("Bāmyān") == "Bamyan"
+        assert clean_name("Nuristan") == "Nuristan"
+        assert clean_name("حلب") == ""
+
+    def test_name_normalizer(self):
+        normalizer = NameNormalizer(max_size=2)
+        assert normalizer.normalize("KABUL") == "Kabul"
+        assert normalizer.normalize(12) == "12"
+        assert normalizer.normalize("KABUL") == "Kabul"
+        assert normalizer.hits == 1
+        assert normalizer.misses == 2
+
+        names = Series(["BAMYAN", None, "Bāmyān", "", "BAMYAN", "herat"])
+        assert normalizer.normalize_names(names) == [
+            "Bamyan",
+            None,
+            "Bamyan",
+            "",
+            "Bamyan",
+            "Herat",
+        ]
+        assert normalizer.hits == 2
+        assert normalizer.misses == 5
+        assert normalizer.time > 0
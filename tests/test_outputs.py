@@ -0,0 +1,73 @@
+import gzip
+from datetime import date
+from os.path import join
+
+import pytest
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.outputs import (
+    compress_gzip,
+    compress_zstd,
+    is_writer_available,
+    write_parquet,
+)
+
+
+class TestOutputs:
+    @pytest.fixture
+    def countries(self, row):
+        return [
+            [
+                row(1, "AB01", "East", "ABC", "ABC"),
+                row(2, "AB0101", "Coast", "AB01", "ABC", "2023-05-31"),
+            ],
+            [],
+            [
+                row(1, "XY01", "North", "XYZ", "XYZ", None),
+                row(1, "XY02", "South", "XYZ", "XYZ", "31/12/2020"),
+            ],
+        ]
+
+    def test_is_writer_available(self):
+        assert is_writer_available("csv.gz") is True
+        with pytest.raises(ValueError):
+            is_writer_available("csv.bz2")
+
+    def test_compress(self):
+        data = "﻿Location,P-Code\nXYZ,XY01\n".encode()
+        with temp_dir("TestCompress") as tempdir:
+            path = join(tempdir, "global_pcodes.csv")
+            with open(path, "wb") as f:
+                f.write(data)
+            gzip_path = join(tempdir, "global_pcodes.csv.gz")
+            compress_gzip(path, gzip_path)
+            with gzip.open(gzip_path, "rb") as f:
+                assert f.read() == data
+            zstandard = pytest.importorskip("zstandard")
+            zstd_path = join(tempdir, "global_pcodes.csv.zst")
+            compress_zstd(path, zstd_path)
+            with open(zstd_path, "rb") as f:
+                assert zstandard.ZstdDecompressor().stream_reader(f).read() == data
+
+    def test_write_parquet(self, countries):
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        with temp_dir("TestWriteParquet") as tempdir:
+            path = join(tempdir, "global_pcodes.parquet")
+            assert write_parquet(path, iter(countries)) == 4
+            parquet_file = pq.ParquetFile(path)
+            assert parquet_file.metadata.num_row_groups == 2
+            table = parquet_file.read()
+        assert table.schema.field("Location").type == pa.dictionary(
+            pa.int16(), pa.string()
+        )
+        assert table.schema.field("Admin Level").type == pa.int8()
+        assert table.schema.field("Valid from date").type == pa.date32()
+        assert table.column("Location").to_pylist() == ["ABC", "ABC", "XYZ", "XYZ"]
+        assert table.column("Admin Level").to_pylist() == [1, 2, 1, 1]
+        assert table.column("Valid from date").to_pylist() == [
+            date(2024, 1, 1),
+            date(2023, 5, 31),
+            None,
+            None,
+        ]
@@ -0,0 +1,65 @@
+import os
+from os.path import join
+from time import sleep
+
+import pytest
+from hdx.data.resource import Resource
+from pandas import DataFrame
+
+from hdx.scraper.pcodes.parser import GazetteerParseError, GazetteerParser
+
+
+@pytest.fixture
+def saved_dir(temp_folder):
+    """Gazetteers are written to the temporary folder for the retriever to read"""
+    return temp_folder
+
+
+class TestGazetteerParser:
+    def test_parse(self):
+        with GazetteerParser(workers=2, timeout=30) as parser:
+            assert parser.parse(os.path.basename, "/data/afg.xlsx") == "afg.xlsx"
+            with pytest.raises(GazetteerParseError, match="ValueError"):
+                parser.parse(int, "afg.xlsx")
+            with pytest.raises(GazetteerParseError, match="stopped unexpectedly"):
+                parser.parse(os._exit, 1)
+            assert parser.parse(os.path.basename, "/data/arm.xlsx") == "arm.xlsx"
+            assert (parser.parsed, parser.failed, parser.restarts) == (2, 2, 2)
+
+    def test_timeout(self):
+        with GazetteerParser(workers=1, timeout=5) as parser:
+            assert parser.parse(os.path.basename, "/data/afg.xlsx") == "afg.xlsx"
+            with pytest.raises(GazetteerParseError, match="timed out"):
+                parser.parse(sleep, 60)
+            assert parser.parse(os.path.basename, "/data/arm.xlsx") == "arm.xlsx"
+            assert parser.restarts == 1
+
+    def test_open_gazetteers(self, retriever, make_pcodes, error_handler, temp_folder):
+        resources = [
+            Resource({"name": name, "url": f"http://test/download/{name}"})
+            for name in ("xyz_broken.xlsx", "xyz_gazetteer.xlsx", "xyz_corrupt.xlsx")
+        ]
+        paths = [
+            join(temp_folder, retriever.get_filename(r["url"])[0]) for r in resources
+        ]
+        for path in (paths[0], paths[2]):
+            with open(path, "w") as f:
+                f.write("not a workbook")
+        DataFrame({"ADM1_PCODE": ["XY01"], "ADM1_EN": ["North"]}).to_excel(
+            paths[1], sheet_name="xyz_adm1", index=False
+        )
+        with GazetteerParser(workers=1, timeout=60) as parser:
+            pcodes = make_pcodes(parser=parser)
+            data = pcodes.open_gazetteers(resources[:2], "XYZ")
+            assert list(data) == ["xyz_adm1"]
+            assert error_handler.shared_errors["error"] == {}
+            broken = [resources[0], resources[2]]
+            assert pcodes.open_gazetteers(broken, "XYZ") == {}
+        # Without a parser, the last gazetteer is also reported rather than raising
+        assert make_pcodes().open_gazetteers(resources[2:], "XYZ") == {}
+        errors = error_handler.shared_errors["error"]["PCodes - cod-ab-xyz"]
+        assert sorted(error.split(":")[0] for error in errors) == [
+            "PCodes - cod-ab-xyz - Could not parse xyz_broken.xlsx",
+            "PCodes - cod-ab-xyz - Could not parse xyz_corrupt.xlsx",
+            "PCodes - cod-ab-xyz - Could not read xyz_corrupt.xlsx",
+        ]
@@ -1,121 +1,458 @@
-from os.path import join
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.util import find_spec
+from os.path import exists, join
+from threading import Thread
+from time import sleep
 
-from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+import pytest
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
 from hdx.utilities.compare import assert_files_same
 from hdx.utilities.downloader import Download
-from hdx.utilities.path import temp_dir
 from hdx.utilities.retriever import Retrieve
+from pandas import DataFrame, Timestamp
 
-from hdx.scraper.pcodes.pcodes import Pcodes
+from hdx.scraper.pcodes import pcodes as pcodes_module
+from hdx.scraper.pcodes.datasets import DatasetIndex
+from hdx.scraper.pcodes.pcodes import _get_excel_engine
+from hdx.scraper.pcodes.store import CountryPcodes, SpilledCountryPcodes
 
 
 class TestPCodes:
+    @pytest.mark.parametrize(
+        "legacy_rows, workers, excel_engine, memory_limit",
+        [
+            (False, 1, "default", None),
+            (True, 1, "default", None),
+            (False, 3, "default", None),
+            (False, 1, "calamine", None),
+            (False, 3, "default", 0),
+        ],
+    )
     def test_pcodes(
         self,
-        configuration,
+        legacy_rows,
+        workers,
+        excel_engine,
+        memory_limit,
         read_dataset,
-        fixtures_dir,
-        input_dir,
+        make_pcodes,
+        temp_folder,
         config_dir,
     ):
-        with HDXErrorHandler() as error_handler:
-            with temp_dir(
-                "TestPcodes",
-                delete_on_success=True,
-                delete_on_failure=False,
-            ) as tempdir:
-                with Download(user_agent="test") as downloader:
-                    retriever = Retrieve(
-                        downloader=downloader,
-                        fallback_dir=tempdir,
-                        saved_dir=input_dir,
-                        temp_dir=tempdir,
-                        save=False,
-                        use_saved=True,
-                    )
-
-                    pcodes = Pcodes(
-                        configuration=configuration,
-                        retriever=retriever,
-                        temp_folder=tempdir,
-                        error_handler=error_handler,
-                    )
-                    countries = ["AFG", "ARM", "BES", "IDN", "MKD"]
-                    for country in countries:
-                        pcodes.get_pcodes(country)
-                        pcodes.check_parents(country)
-                        pcodes.get_pcode_lengths(country)
-
-                    assert len(pcodes.pcodes) == 3
-                    assert len(pcodes.pcode_lengths) == 3
-
-                    dataset = pcodes.generate_dataset()
-                    dataset.update_from_yaml(
-                        path=join(config_dir, "hdx_dataset_static.yaml")
-                    )
-                    assert dataset == {
-                        "name": "global-pcodes",
-                        "title": "Global P-Code List",
-                        "groups": [{"name": "world"}],
-                        "tags": [
-                            {
-                                "name": "administrative boundaries-divisions",
-                                "vocabulary_id": "b891512e-9516-4bf5-962a-7a289772a2a1",
-                            },
-                        ],
-                        "dataset_date": "[2014-10-01T00:00:00 TO *]",
-                        "license_id": "cc-by",
-                        "methodology": "Other",
-                        "methodology_other": "Pulled from COD gazetteers",
-                        "caveats": "",
-                        "dataset_source": "HDX",
-                        "package_creator": "HDX Data Systems Team",
-                        "private": False,
-                        "maintainer": "aa13de36-28c5-47a7-8d0b-6d7c754ba8c8",
-                        "owner_org": "hdx",
-                        "data_update_frequency": 7,
-                        "notes": "CSV containing subnational p-codes, their "
-                        "corresponding administrative names, parent p-codes, and "
-                        "reference dates for the world (where available). These are "
-                        "constructed using the COD gazetteers.\nEnglish names are used "
-                        "where available, followed by names written in Latin alphabets."
-                        "\nNote that Indonesia admin4 is not included for now, as that "
-                        "data is contained in a second, non-standard gazetteer.\n",
-                    }
-
-                    resources = dataset.get_resources()
-                    assert resources == [
-                        {
-                            "name": "global_pcodes.csv",
-                            "description": "Table contains the 3-digit ISO code, admin "
-                            "level, p-code, administrative name, parent p-code, and "
-                            "date.",
-                            "p_coded": True,
-                            "format": "csv",
-                        },
-                        {
-                            "name": "global_pcodes_adm_1_2.csv",
-                            "description": "Data for admin levels 1 and 2. Table "
-                            "contains the 3-digit ISO code, admin level, p-code, "
-                            "administrative name, parent p-code, and date.",
-                            "p_coded": True,
-                            "format": "csv",
-                        },
-                        {
-                            "name": "global_pcode_lengths.csv",
-                            "description": "P-code lengths for all countries at all "
-                            "levels. Table contains the 2 or 3 digit ISO code present in "
-                            "the p-codes, and p-code lengths.",
-                            "format": "csv",
-                        },
-                    ]
-
-                    for file_name in [
-                        "global_pcodes.csv",
-                        "global_pcodes_adm_1_2.csv",
-                        "global_pcode_lengths.csv",
-                    ]:
-                        assert_files_same(
-                            join("tests", "fixtures", file_name),
-                            join(tempdir, file_name),
-                        )
+        if excel_engine == "calamine":
+            pytest.importorskip("python_calamine")
+        pcodes = make_pcodes(
+            legacy_rows=legacy_rows,
+            excel_engine=excel_engine,
+            memory_limit=memory_limit,
+        )
+        countries = ["AFG", "ARM", "BES", "IDN", "MKD"]
+        pcodes.process_countries(countries, workers=workers)
+
+        assert len(pcodes.pcodes) == 3
+        spilled = [
+            isinstance(rows, SpilledCountryPcodes) for rows in pcodes.pcodes.values()
+        ]
+        assert spilled == [memory_limit is not None] * 3
+        assert len(pcodes.pcode_lengths) == 3
+
+        dataset = pcodes.generate_dataset()
+        dataset.update_from_yaml(path=join(config_dir, "hdx_dataset_static.yaml"))
+        assert dataset == {
+            "name": "global-pcodes",
+            "title": "Global P-Code List",
+            "groups": [{"name": "world"}],
+            "tags": [
+                {
+                    "name": "administrative boundaries-divisions",
+                    "vocabulary_id": "b891512e-9516-4bf5-962a-7a289772a2a1",
+                },
+            ],
+            "dataset_date": "[2014-10-01T00:00:00 TO *]",
+            "license_id": "cc-by",
+            "methodology": "Other",
+            "methodology_other": "Pulled from COD gazetteers",
+            "caveats": "",
+            "dataset_source": "HDX",
+            "package_creator": "HDX Data Systems Team",
+            "private": False,
+            "maintainer": "aa13de36-28c5-47a7-8d0b-6d7c754ba8c8",
+            "owner_org": "hdx",
+            "data_update_frequency": 7,
+            "notes": "CSV containing subnational p-codes, their "
+            "corresponding administrative names, parent p-codes, and "
+            "reference dates for the world (where available). These are "
+            "constructed using the COD gazetteers.\nEnglish names are used "
+            "where available, followed by names written in Latin alphabets."
+            "\nNote that Indonesia admin4 is not included for now, as that "
+            "data is contained in a second, non-standard gazetteer.\n",
+        }
+
+        expected_resources = [
+            {
+                "name": "global_pcodes.csv",
+                "description": "Table contains the 3-digit ISO code, admin "
+                "level, p-code, administrative name, parent p-code, and "
+                "date.",
+                "p_coded": True,
+                "format": "csv",
+            },
+            {
+                "name": "global_pcodes_adm_1_2.csv",
+                "description": "Data for admin levels 1 and 2. Table "
+                "contains the 3-digit ISO code, admin level, p-code, "
+                "administrative name, parent p-code, and date.",
+                "p_coded": True,
+                "format": "csv",
+            },
+            {
+                "name": "global_pcodes.csv.gz",
+                "description": "global_pcodes.csv compressed with gzip.",
+                "format": "gz",
+            },
+        ]
+        if find_spec("pyarrow"):
+            expected_resources.append(
+                {
+                    "name": "global_pcodes.parquet",
+                    "description": "Data for all admin levels in Parquet "
+                    "format, with one row group per country. Table contains "
+                    "the 3-digit ISO code, admin level, p-code, "
+                    "administrative name, parent p-code, and date.",
+                    "format": "parquet",
+                }
+            )
+        expected_resources.append(
+            {
+                "name": "global_pcode_lengths.csv",
+                "description": "P-code lengths for all countries at all "
+                "levels. Table contains the 2 or 3 digit ISO code present in "
+                "the p-codes, and p-code lengths with the number of "
+                "p-codes of each length.",
+                "format": "csv",
+            }
+        )
+        assert dataset.get_resources() == expected_resources
+
+        for file_name in [
+            "global_pcodes.csv",
+            "global_pcodes_adm_1_2.csv",
+            "global_pcode_lengths.csv",
+        ]:
+            assert_files_same(
+                join("tests", "fixtures", file_name),
+                join(temp_folder, file_name),
+            )
+        pcodes.remove_spilled_pcodes()
+        assert not exists(join(temp_folder, "spill"))
+        assert len(pcodes.pcodes) == (0 if memory_limit is not None else 3)
+
+    @pytest.mark.parametrize("legacy_rows", [False, True])
+    def test_duplicate_pcodes(self, legacy_rows, make_pcodes, error_handler, input_dir):
+        dataset = Dataset.load_from_json(join(input_dir, "dataset-cod-ab-afg.json"))
+        data = {
+            "ADM1": DataFrame(
+                {
+                    "ADM1_PCODE": ["AF01", "AF02", "AF02"],
+                    "ADM1_EN": ["Kabul", "Kapisa", "Kapisa"],
+                    "validOn": [Timestamp("2021-11-17")] * 3,
+                }
+            ),
+            "ADM2": DataFrame(
+                {
+                    "ADM2_PCODE": ["AF0101", "AF0102", "AF0102", "AF0102"],
+                    "ADM2_EN": ["KABUL", "Paghman", "Paghman", "Shakardara"],
+                    "ADM1_PCODE": ["AF01"] * 4,
+                    "validOn": [44517] * 4,
+                }
+            ),
+        }
+        pcodes = make_pcodes(retriever=None, legacy_rows=legacy_rows)
+        pcodes.get_pcodes_from_gazetteer(data, "AFG", dataset)
+        assert pcodes.pcodes == {}
+        assert error_handler.shared_errors["error"] == {
+            "PCodes - cod-ab-afg": {
+                "PCodes - cod-ab-afg - 1 duplicate p-codes found at adm1: AF02 (2 times)",
+                "PCodes - cod-ab-afg - 1 duplicate p-codes found at adm2: AF0102 (3 times)",
+            }
+        }
+
+    def test_spill_pcodes(self, make_pcodes):
+        sizes = {}
+        pcodes = make_pcodes(retriever=None)
+        for iso, no_rows in (("AFG", 300), ("ARM", 100), ("MKD", 200)):
+            rows = CountryPcodes(
+                {"Location": iso, "P-Code": f"{iso[:2]}{i:04d}", "Name": "X"}
+                for i in range(no_rows)
+            )
+            sizes[iso] = rows.get_size()
+            pcodes.pcodes[iso] = rows
+        pcodes._memory_limit = sizes["AFG"] + sizes["ARM"]
+        for iso in sizes:
+            pcodes.spill_pcodes(iso)
+        spilled = {
+            iso: isinstance(rows, SpilledCountryPcodes)
+            for iso, rows in pcodes.pcodes.items()
+        }
+        assert spilled == {"AFG": False, "ARM": False, "MKD": True}
+        assert pcodes.kept_size == pcodes._memory_limit
+        assert len(pcodes.pcodes["MKD"]) == 200
+
+    def test_check_parents(self, make_pcodes, error_handler, temp_folder, row):
+        pcodes = make_pcodes(retriever=None)
+        pcodes.pcodes["XYZ"] = CountryPcodes(
+            [
+                row(1, "XY01", parent="XYZ"),
+                row(2, "XY0101", parent="XY01"),
+                row(2, "XY0102", parent="XY02"),
+                row(2, "XY0103", parent="XY02"),
+                row(3, "XY010101", parent="XY01"),
+                row(3, "XY010201", parent="XY020301"),
+                row(4, "XY020301", parent="XY010201"),
+            ]
+        )
+        pcodes.check_parents("XYZ")
+        assert error_handler.shared_errors["error"] == {
+            "PCodes - cod-ab-xyz": {
+                "PCodes - cod-ab-xyz - parent pcode XY02 not found",
+            }
+        }
+        assert pcodes.integrity["XYZ"] == {
+            "Units": 7,
+            "Missing parents": [
+                {"Parent P-Code": "XY02", "Orphans": ["XY0102", "XY0103"]}
+            ],
+            "Wrong level parents": [
+                {
+                    "P-Code": "XY010101",
+                    "Admin Level": 3,
+                    "Parent P-Code": "XY01",
+                    "Parent Admin Level": 1,
+                },
+                {
+                    "P-Code": "XY010201",
+                    "Admin Level": 3,
+                    "Parent P-Code": "XY020301",
+                    "Parent Admin Level": 4,
+                },
+            ],
+            "Cycles": [["XY010201", "XY020301"]],
+        }
+        path = join(temp_folder, "integrity.json")
+        pcodes.write_integrity_report(path)
+        with open(path) as f:
+            assert json.load(f) == {"XYZ": pcodes.integrity["XYZ"]}
+
+        # ARM admin 3 units have admin 1 parents in its header overrides
+        pcodes.pcodes["ARM"] = CountryPcodes(
+            [
+                row(1, "AM01", parent="ARM", location="ARM"),
+                row(2, "AM0101", parent="AM01", location="ARM"),
+                row(3, "AM010101", parent="AM01", location="ARM"),
+                row(3, "AM010102", parent="AM0101", location="ARM"),
+            ]
+        )
+        pcodes.check_parents("ARM")
+        assert pcodes.integrity["ARM"]["Wrong level parents"] == [
+            {
+                "P-Code": "AM010102",
+                "Admin Level": 3,
+                "Parent P-Code": "AM0101",
+                "Parent Admin Level": 2,
+            }
+        ]
+
+    def test_get_pcode_lengths(self, make_pcodes, error_handler, row):
+        pcodes = make_pcodes(retriever=None)
+        pcodes.pcodes["AFG"] = CountryPcodes(
+            [
+                row(1, "AF01", parent="AFG", location="AFG"),
+                row(1, "AFG02", parent="AFG", location="AFG"),
+                row(2, "AF0101", parent="AF01", location="AFG"),
+                row(2, "AF0102", parent="AF01", location="AFG"),
+                row(2, "AF01003", parent="AF01", location="AFG"),
+                row(2, "AFG0201", parent="AFG02", location="AFG"),
+                row(3, "AF0101000001", parent="AF0101", location="AFG"),
+            ]
+        )
+        pcodes.get_pcode_lengths("AFG")
+        pcodes.get_pcode_lengths("XYZ")
+        assert pcodes.pcode_lengths == [
+            {
+                "Location": "AFG",
+                "Country Length": "2|3",
+                "Country Length Counts": "2:5|3:2",
+                "Admin 1 Length": "2",
+                "Admin 1 Length Counts": "2:2",
+                "Admin 2 Length": "2|3",
+                "Admin 2 Length Counts": "2:3|3:1",
+                "Admin 3 Length": "6",
+                "Admin 3 Length Counts": "6:1",
+                "Admin 4 Length": None,
+                "Admin 4 Length Counts": None,
+                "Admin 5 Length": None,
+                "Admin 5 Length Counts": None,
+            }
+        ]
+        assert error_handler.shared_errors["warning"] == {
+            "PCodes - cod-ab-afg": {
+                "PCodes - cod-ab-afg - p-codes start with country codes of lengths 2|3",
+            }
+        }
+
+    def test_get_excel_engine(self, monkeypatch):
+        assert _get_excel_engine("default") is None
+        monkeypatch.setattr(pcodes_module, "find_spec", lambda name: object())
+        assert _get_excel_engine("auto") == "calamine"
+        assert _get_excel_engine("calamine") == "calamine"
+        monkeypatch.setattr(pcodes_module, "find_spec", lambda name: None)
+        assert _get_excel_engine("auto") is None
+        assert _get_excel_engine("calamine") is None
+        with pytest.raises(ValueError):
+            _get_excel_engine("xlsxwriter")
+
+    def test_rank_gazetteers(self, make_pcodes, error_handler):
+        def resource(name, file_format, size, modified, description=""):
+            resource = Resource(
+                {
+                    "name": name,
+                    "description": description,
+                    "url": f"http://test/download/{name}",
+                    "size": size,
+                    "last_modified": modified,
+                }
+            )
+            resource.set_format(file_format)
+            return resource
+
+        dataset = Dataset({"name": "cod-ab-xyz"})
+        dataset.add_update_resources(
+            [
+                resource("xyz_shapes.zip", "shp", 100, "2024-01-01"),
+                resource("XYZ_Admin4_TabularData.xlsx", "xlsx", 9000, "2020-01-01"),
+                resource("xyz_adminboundaries_tabulardata.xls", "xls", 5000, "2023"),
+                resource("xyz_adminboundaries_tabulardata.xlsx", "xlsx", 2000, "2022"),
+                resource("xyz_codes.xlsx", "xlsx", 10, "2024-01-01"),
+                resource("xyz_old.xlsx", "xlsx", 10, "2019", "Old gazetteer"),
+            ]
+        )
+        pcodes = make_pcodes(retriever=None)
+        ranked = pcodes.rank_gazetteers(dataset, "XYZ")
+        assert [r["name"] for r in ranked] == [
+            "xyz_adminboundaries_tabulardata.xlsx",
+            "xyz_adminboundaries_tabulardata.xls",
+            "XYZ_Admin4_TabularData.xlsx",
+            "xyz_old.xlsx",
+        ]
+
+        dataset = Dataset({"name": "cod-ab-xyz"})
+        dataset.add_update_resources([resource("xyz.zip", "shp", 1, "2024")])
+        assert pcodes.rank_gazetteers(dataset, "XYZ") == []
+        assert error_handler.shared_errors["error"] == {
+            "PCodes - cod-ab-xyz": {
+                "PCodes - cod-ab-xyz - Could not find gazetteer",
+            }
+        }
+
+    def test_open_gazetteers(self, make_pcodes, retriever, error_handler, temp_folder):
+        resources = [
+            Resource({"name": name, "url": f"http://test/download/{name}"})
+            for name in ("xyz_notes.xlsx", "xyz_broken.xlsx", "xyz_gazetteer.xlsx")
+        ]
+        retriever = Retrieve(
+            downloader=retriever.downloader,
+            fallback_dir=temp_folder,
+            saved_dir=temp_folder,
+            temp_dir=temp_folder,
+            save=False,
+            use_saved=True,
+        )
+        paths = [
+            join(temp_folder, retriever.get_filename(r["url"])[0]) for r in resources
+        ]
+        DataFrame({"Note": ["x"]}).to_excel(paths[0], index=False)
+        with open(paths[1], "w") as f:
+            f.write("not a workbook")
+        DataFrame({"ADM1_PCODE": ["XY01"], "ADM1_EN": ["North"]}).to_excel(
+            paths[2], sheet_name="xyz_adm1", index=False
+        )
+        pcodes = make_pcodes(retriever=retriever)
+        data = pcodes.open_gazetteers(resources, "XYZ")
+        assert list(data) == ["xyz_adm1"]
+        assert error_handler.shared_errors["error"] == {}
+        assert pcodes.open_gazetteers(resources[:1], "XYZ") == {}
+        assert pcodes.open_gazetteers(resources[1:2], "XYZ") == {}
+        errors = error_handler.shared_errors["error"]["PCodes - cod-ab-xyz"]
+        assert sorted(error.split(":")[0] for error in errors) == [
+            "PCodes - cod-ab-xyz - Could not find admin tabs in xyz_notes.xlsx",
+            "PCodes - cod-ab-xyz - Could not read xyz_broken.xlsx",
+        ]
+
+    def test_concurrent_downloads(
+        self, make_pcodes, retriever, temp_folder, input_dir, monkeypatch
+    ):
+        """Gazetteers downloaded over HTTP by several threads at once, slowly so
+        that the downloads overlap, give the same p-codes as saved files"""
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = join(input_dir, self.path[1:])
+                if not exists(path):
+                    self.send_error(404)
+                    return
+                with open(path, "rb") as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                for start in range(0, len(body), 16384):
+                    self.wfile.write(body[start : start + 16384])
+                    sleep(0.005)
+
+            def log_message(self, *args):
+                pass
+
+        thread_downloaders = []
+
+        class ThreadDownload(Download):
+            closed = False
+
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                thread_downloaders.append(self)
+
+            def close_response(self):
+                super().close_response()
+                self.closed = True
+
+        monkeypatch.setattr(pcodes_module, "Download", ThreadDownload)
+        countries = ["AFG", "ARM", "MKD"]
+        datasets = DatasetIndex.load_from_json(input_dir)
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        Thread(target=httpd.serve_forever, daemon=True).start()
+        server = f"http://127.0.0.1:{httpd.server_address[1]}"
+        expected = make_pcodes(datasets=datasets)
+        expected.process_countries(countries)
+
+        for iso in countries:
+            for resource in datasets.get(iso).get_resources():
+                filename, _ = retriever.get_filename(resource["url"])
+                resource["url"] = f"{server}/{filename}"
+        retriever = Retrieve(
+            downloader=retriever.downloader,
+            fallback_dir=temp_folder,
+            saved_dir=temp_folder,
+            temp_dir=temp_folder,
+            save=False,
+            use_saved=False,
+        )
+        pcodes = make_pcodes(retriever=retriever, datasets=datasets)
+        pcodes.process_countries(countries, workers=3)
+        httpd.shutdown()
+        httpd.server_close()
+        assert pcodes.pcodes == expected.pcodes
+        assert pcodes.pcode_lengths == expected.pcode_lengths
+        assert 0 < len(thread_downloaders) <= 3
+        assert all(downloader.closed for downloader in thread_downloaders)
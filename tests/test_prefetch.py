@@ -0,0 +1,147 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import listdir
+from os.path import join
+from threading import Lock, Thread
+
+import pytest
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import temp_dir
+from hdx.utilities.retriever import Retrieve
+from requests import HTTPError
+
+from hdx.scraper.pcodes.datasets import DatasetIndex
+from hdx.scraper.pcodes.prefetch import GazetteerPrefetcher
+
+CONTENT = bytes(range(256)) * 400
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+    fail_first = True
+    lock = Lock()
+
+    def do_GET(self):
+        Handler.requests.append((self.path, self.headers.get("Range")))
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"][6:-1])
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        with Handler.lock:
+            fail = Handler.fail_first
+            Handler.fail_first = False
+        if fail:
+            self.wfile.write(body[:70000])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    Handler.fail_first = True
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestGazetteerPrefetcher:
+    def test_prefetch(self, server):
+        with temp_dir("TestGazetteerPrefetcher") as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader=downloader,
+                    fallback_dir=tempdir,
+                    saved_dir=join(tempdir, "saved"),
+                    temp_dir=tempdir,
+                    save=True,
+                    use_saved=False,
+                )
+                urls = [f"{server}/gazetteer{i}.xlsx" for i in range(3)]
+                with GazetteerPrefetcher(retriever, backoff=0) as prefetcher:
+                    prefetcher.prefetch(urls)
+                    completed = list(prefetcher.iterate_completed(urls))
+                    assert sorted(completed) == urls
+                    path = prefetcher.get(urls[0])
+                    assert str(path) == join(tempdir, "saved", "gazetteer0.xlsx")
+                    for url in urls:
+                        with open(prefetcher.get(url), "rb") as f:
+                            assert f.read() == CONTENT
+                    assert prefetcher.downloaded == 3
+                    assert prefetcher.retried == 1
+                    assert prefetcher.resumed == 1
+                    assert (f"/{urls[0].split('/')[-1]}", None) in Handler.requests
+                    assert any(header for _, header in Handler.requests)
+                    assert sorted(listdir(join(tempdir, "saved"))) == [
+                        "gazetteer0.xlsx",
+                        "gazetteer1.xlsx",
+                        "gazetteer2.xlsx",
+                    ]
+
+                    url = f"{server}/missing.xlsx"
+                    future = prefetcher.submit(url)
+                    with pytest.raises(HTTPError):
+                        future.result()
+                    assert prefetcher.retried == 1
+
+    def test_use_saved(self, server):
+        with temp_dir("TestGazetteerPrefetcherSaved") as tempdir:
+            with open(join(tempdir, "gazetteer.xlsx"), "wb") as f:
+                f.write(CONTENT)
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader=downloader,
+                    fallback_dir=tempdir,
+                    saved_dir=tempdir,
+                    temp_dir=tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                with GazetteerPrefetcher(retriever) as prefetcher:
+                    url = f"{server}/gazetteer.xlsx"
+                    prefetcher.prefetch([url])
+                    assert str(prefetcher.get(url)) == join(tempdir, "gazetteer.xlsx")
+                    assert prefetcher.downloaded == 0
+        assert Handler.requests == []
+
+    def test_pcodes_prefetch(self, input_dir, retriever, make_pcodes):
+        countries = ["BES", "AFG", "ARM"]
+        results = []
+        for download_workers in (0, 2):
+            with HDXErrorHandler() as error_handler:
+                prefetcher = None
+                if download_workers:
+                    prefetcher = GazetteerPrefetcher(
+                        retriever, workers=download_workers
+                    )
+                pcodes = make_pcodes(
+                    error_handler=error_handler,
+                    datasets=DatasetIndex.load_from_json(input_dir),
+                    prefetcher=prefetcher,
+                )
+                pcodes.process_countries(countries)
+                if prefetcher:
+                    prefetcher.close()
+                results.append(
+                    (
+                        {iso: list(rows) for iso, rows in pcodes.pcodes.items()},
+                        pcodes.pcode_lengths,
+                    )
+                )
+        assert list(results[1][0]) == [iso for iso in countries if iso in results[1][0]]
+        assert results[0] == results[1]
@@ -0,0 +1,99 @@
+import json
+import tracemalloc
+from csv import DictReader
+from os.path import exists, join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.datasets import DatasetIndex
+from hdx.scraper.pcodes.report import RunReport
+
+
+class TestRunReport:
+    def test_run_report(self):
+        report = RunReport(trace_memory=True)
+        with report.stage("rows", "AFG"):
+            rows = [str(i) * 10 for i in range(10000)]
+        with report.stage("rows", "AFG"):
+            pass
+        with report.stage("download", "ARM"):
+            pass
+        with report.stage("write_pcodes"):
+            pass
+        with report.stage("total", "IDN"):
+            with report.stage("rows", "IDN"):
+                idn_rows = [str(i) * 10 for i in range(10000)]
+            del idn_rows
+            with report.stage("pcode_lengths", "IDN"):
+                pass
+        report.set_rows("AFG", len(rows))
+        report.add_bytes("AFG", 100)
+        report.add_bytes("AFG", 50)
+        tracemalloc.stop()
+
+        locations = report.get_locations()
+        assert list(locations) == ["AFG", "ARM", "global", "IDN"]
+        afg = locations["AFG"]
+        assert afg["Rows"] == 10000
+        assert afg["Bytes Downloaded"] == 150
+        assert afg["Stages"]["rows"]["Peak Traced"] > 100000
+        assert afg["Stages"]["rows"]["Process Peak RSS"] > 0
+        idn = locations["IDN"]["Stages"]
+        assert idn["rows"]["Peak Traced"] > 100000
+        assert idn["pcode_lengths"]["Peak Traced"] < idn["rows"]["Peak Traced"]
+        assert idn["total"]["Peak Traced"] >= idn["rows"]["Peak Traced"]
+        assert report.get_time("AFG") == afg["Stages"]["rows"]["Time"]
+
+        with temp_dir("TestRunReport") as tempdir:
+            path = join(tempdir, "report.json")
+            report.write(path)
+            with open(path) as f:
+                assert json.load(f)[0]["Location"] == "AFG"
+            path = join(tempdir, "report.csv")
+            report.write(path)
+            with open(path) as f:
+                rows = list(DictReader(f))
+            assert [(row["Location"], row["Stage"]) for row in rows] == [
+                ("AFG", "rows"),
+                ("ARM", "download"),
+                ("global", "write_pcodes"),
+                ("IDN", "rows"),
+                ("IDN", "pcode_lengths"),
+                ("IDN", "total"),
+            ]
+            assert rows[0]["Bytes Downloaded"] == "150"
+
+    def test_pcodes_report(self, input_dir, make_pcodes, temp_folder):
+        profile_path = join(temp_folder, "profile.prof")
+        report = RunReport(profile_iso="ARM", profile_path=profile_path)
+        pcodes = make_pcodes(
+            datasets=DatasetIndex.load_from_json(input_dir), report=report
+        )
+        pcodes.process_countries(["ARM", "BES"])
+        pcodes.generate_dataset()
+        assert exists(profile_path)
+        locations = report.get_locations()
+        assert list(locations["ARM"]["Stages"]) == [
+            "read_dataset",
+            "find_gazetteer",
+            "download",
+            "read_excel",
+            "rows",
+            "check_parents",
+            "pcode_lengths",
+            "total",
+        ]
+        assert locations["ARM"]["Rows"] == len(pcodes.pcodes["ARM"])
+        assert locations["ARM"]["Bytes Downloaded"] > 0
+        assert list(locations["BES"]["Stages"]) == [
+            "read_dataset",
+            "find_gazetteer",
+            "check_parents",
+            "pcode_lengths",
+            "total",
+        ]
+        assert list(locations["global"]["Stages"]) == [
+            "write_pcodes",
+            "write_outputs",
+            "write_pcode_lengths",
+        ]
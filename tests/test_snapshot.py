@@ -0,0 +1,64 @@
+from os.path import exists, join
+from shutil import copytree
+
+from hdx.api.locations import Locations
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.data.vocabulary import Vocabulary
+from hdx.utilities.compare import assert_files_same
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.__main__ import main
+from hdx.scraper.pcodes.datasets import DatasetIndex
+from hdx.scraper.pcodes.snapshot import Snapshot
+
+
+def no_read(*args, **kwargs):
+    raise AssertionError("Unexpected read from HDX")
+
+
+class TestSnapshot:
+    def test_record_replay(self, configuration, read_dataset, monkeypatch):
+        monkeypatch.setattr(Resource, "_formats_dict", {"csv": "csv"})
+        monkeypatch.setattr(Vocabulary, "_tags_dict", {"tag": {"Action to Take": "ok"}})
+        monkeypatch.setattr(
+            Vocabulary, "_approved_vocabulary", Vocabulary({"name": "approved"})
+        )
+        with temp_dir("TestSnapshot") as tempdir:
+            snapshot = Snapshot(tempdir)
+            snapshot.read_hdx_lookups()
+            dataset = snapshot.read_dataset("cod-ab-afg")
+            assert snapshot.read_dataset("cod-ab-mmr") is None
+            assert exists(join(tempdir, "dataset-cod-ab-afg.json"))
+
+            monkeypatch.setattr(Resource, "_formats_dict", None)
+            monkeypatch.setattr(Vocabulary, "_tags_dict", None)
+            monkeypatch.setattr(Dataset, "read_from_hdx", staticmethod(no_read))
+            snapshot = Snapshot(tempdir, replay=True)
+            snapshot.read_hdx_lookups()
+            assert Resource._formats_dict == {"csv": "csv"}
+            assert Vocabulary._tags_dict == {"tag": {"Action to Take": "ok"}}
+            assert Vocabulary._approved_vocabulary["name"] == "approved"
+            assert Locations.validlocations()[0]["name"] == "afg"
+            assert snapshot.read_dataset("cod-ab-afg") == dataset
+            assert snapshot.read_dataset("cod-ab-mmr") is None
+            assert snapshot.read_datasets().get("AFG") == dataset
+
+    def test_replay_main(self, configuration, fixtures_dir, input_dir, monkeypatch):
+        monkeypatch.setattr(Dataset, "read_from_hdx", staticmethod(no_read))
+        monkeypatch.setattr(DatasetIndex, "read_from_hdx", no_read)
+        monkeypatch.setattr(Dataset, "create_in_hdx", no_read)
+        with temp_dir("TestReplayMain") as tempdir:
+            folder = join(tempdir, "snapshot")
+            copytree(input_dir, folder)
+            main(replay=folder, countries="AFG,ARM,BES,IDN,MKD")
+            output_folder = join(folder, "output")
+            assert exists(join(output_folder, "dataset.json"))
+            for file_name in [
+                "global_pcodes.csv",
+                "global_pcodes_adm_1_2.csv",
+                "global_pcode_lengths.csv",
+            ]:
+                assert_files_same(
+                    join(fixtures_dir, file_name), join(output_folder, file_name)
+                )
@@ -0,0 +1,67 @@
+from os.path import join
+
+from hdx.api.utilities.hdx_error_handler import HDXErrorHandler
+from hdx.data.dataset import Dataset
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.state import RunState
+
+
+class TestRunState:
+    def test_incremental(
+        self, configuration, read_dataset, make_pcodes, temp_folder, monkeypatch
+    ):
+        countries = ["AFG", "ARM", "BES"]
+        modified_times = {
+            f"cod-ab-{iso.lower()}": Dataset.read_from_hdx(f"cod-ab-{iso.lower()}")[
+                "metadata_modified"
+            ]
+            for iso in countries
+        }
+
+        def search_in_hdx(**kwargs):
+            return [
+                {"name": name, "metadata_modified": modified}
+                for name, modified in modified_times.items()
+            ]
+
+        monkeypatch.setattr(Dataset, "search_in_hdx", staticmethod(search_in_hdx))
+        read_from_hdx = Dataset.read_from_hdx
+        datasets_read = []
+
+        def record_read_from_hdx(name):
+            datasets_read.append(name)
+            return read_from_hdx(name)
+
+        monkeypatch.setattr(
+            Dataset, "read_from_hdx", staticmethod(record_read_from_hdx)
+        )
+
+        def run(tempdir):
+            state = RunState(join(tempdir, "state.json.gz"), configuration)
+            state.read_modified_times()
+            with HDXErrorHandler() as error_handler:
+                pcodes = make_pcodes(error_handler=error_handler, state=state)
+                pcodes.process_countries(countries)
+            state.save()
+            return pcodes, error_handler.shared_errors, state
+
+        with temp_dir("TestRunState") as tempdir:
+            pcodes, errors, state = run(tempdir)
+            assert datasets_read == ["cod-ab-afg", "cod-ab-arm", "cod-ab-bes"]
+            assert (state.updated, state.reused) == (3, 0)
+
+            datasets_read.clear()
+            reused_pcodes, reused_errors, state = run(tempdir)
+            assert datasets_read == []
+            assert (state.updated, state.reused) == (0, 3)
+            assert reused_pcodes.pcodes == pcodes.pcodes
+            assert reused_pcodes.pcode_lengths == pcodes.pcode_lengths
+            assert reused_errors == errors
+
+            modified_times["cod-ab-arm"] = "2030-01-01T00:00:00"
+            reused_pcodes, reused_errors, state = run(tempdir)
+            assert datasets_read == ["cod-ab-arm"]
+            assert (state.updated, state.reused) == (1, 2)
+            assert reused_pcodes.pcodes == pcodes.pcodes
+            assert reused_errors == errors
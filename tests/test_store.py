@@ -0,0 +1,90 @@
+import tracemalloc
+from os.path import join
+
+from hdx.utilities.path import temp_dir
+
+from hdx.scraper.pcodes.store import CountryPcodes, SpilledCountryPcodes
+
+
+def iterate_rows(no_rows):
+    return (
+        {
+            "Location": "AFG",
+            "Admin Level": str(level),
+            "P-Code": f"AF{i:06d}{level}",
+            "Name": f"Unit {i}",
+            "Parent P-Code": f"AF{i // 10:06d}{level - 1}",
+            "Valid from date": "2021-11-17",
+        }
+        for i in range(no_rows)
+        for level in (1, 2)
+    )
+
+
+def make_rows(no_rows):
+    return list(iterate_rows(no_rows))
+
+
+def get_allocated(function):
+    tracemalloc.start()
+    try:
+        result = function()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+class TestCountryPcodes:
+    def test_country_pcodes(self):
+        rows = make_rows(3)
+        pcodes = CountryPcodes(rows)
+        assert len(pcodes) == 6
+        assert pcodes[1] == rows[1]
+        assert list(pcodes) == rows
+        assert pcodes == rows
+        assert pcodes == CountryPcodes(rows)
+        assert pcodes.get_column("P-Code") == [row["P-Code"] for row in rows]
+        pcodes.append(
+            {
+                "Location": "AFG",
+                "Admin Level": "1",
+                "P-Code": "AF0000001",
+                "Name": None,
+                "Parent P-Code": "AFG",
+                "Valid from date": "2021-11-17",
+            }
+        )
+        assert [row["P-Code"] for row in pcodes.iterate_sorted()] == [
+            "AF0000001",
+            "AF0000001",
+            "AF0000011",
+            "AF0000021",
+            "AF0000002",
+            "AF0000012",
+            "AF0000022",
+        ]
+        assert pcodes[-1]["Name"] is None
+
+    def test_memory(self):
+        no_rows = 50000
+        dict_size = get_allocated(lambda: make_rows(no_rows))
+        compact_size = get_allocated(lambda: CountryPcodes(iterate_rows(no_rows)))
+        assert 0 < compact_size < dict_size / 2
+
+
+class TestSpilledCountryPcodes:
+    def test_spilled_country_pcodes(self):
+        rows = make_rows(3)
+        rows[0]["Name"] = None
+        pcodes = CountryPcodes(rows)
+        with temp_dir("TestSpilledCountryPcodes") as tempdir:
+            spilled = SpilledCountryPcodes(join(tempdir, "AFG.json"), pcodes)
+            assert len(spilled) == 6
+            assert list(spilled.iterate_sorted()) == list(pcodes.iterate_sorted())
+            assert spilled.get_column("P-Code") == [
+                row["P-Code"] for row in pcodes.iterate_sorted()
+            ]
+            assert spilled[0]["Name"] is None
+            assert spilled == list(pcodes.iterate_sorted())